@@ -0,0 +1,170 @@
+import sys
+import math
+import time
+import argparse
+
+import pandas as pd
+from bson import ObjectId
+
+from card_ingest import build_cards_frame, PERCENT_FIELDS
+from card_presentation import presentation_fields
+from numeric_parser import count_value, percent_value, amount_range, format_percent
+
+# 基准测试：逐行映射（原GenerateCard循环）与按列映射卡片的耗时对比
+
+USER_ID = str(ObjectId())
+FILE_ID = str(ObjectId())
+CREATION_DATE = '2025-01-01 00:00:00'
+
+# 包含脏数据的示例行：带单位的人数、百分比字符串、空值
+SAMPLE_ROWS = [
+    {
+        '来源': '《中药治疗高血压》中国中医杂志', '疾病': '高血压', '方案名称': '标准降压治疗',
+        '方案简介': '使用常规降压药物进行治疗', '治疗时间': '3-6个月', '频次': '每日两次', '费用范围': '1000-2000',
+        '总人数': 100, '有效人数': 99, '临床治愈人数': 60, '未复发人数': 50,
+        '有效率': 0.99, '临床治愈率': '60%', '未复发率': 0.5,
+        '一级风险表现': '轻微头晕', '二级风险表现': '血压波动', '三级风险表现': '严重不良反应',
+        '一级风险概率和': '15%', '二级风险概率和': '5%', '三级风险概率和': '1%',
+        '风险评级': '低', '受益评级': '高', '便利度评级': '中', '受益评分': 8.5, '风险评分': 3, '便利度评分': 7
+    },
+    {
+        '来源': None, '疾病': '慢性萎缩性胃炎', '方案名称': '', '方案简介': '针药结合治疗', '治疗时间': '总疗程为3个月。',
+        '频次': None, '费用范围': '100-1000', '总人数': '93人', '有效人数': '40人', '临床治愈人数': None,
+        '未复发人数': '0', '有效率': '85.11%', '临床治愈率': '0%', '未复发率': '0.0',
+        '一级风险表现': '疼痛', '二级风险表现': None, '三级风险表现': '严重过敏',
+        '一级风险概率和': '25%', '二级风险概率和': 0.03, '三级风险概率和': None,
+        '风险评级': '低风险', '受益评级': '中受益', '便利度评级': None, '受益评分': '5.8', '风险评分': 'abc', '便利度评分': None
+    },
+    {
+        '来源': '张三医生', '疾病': '高血压', '方案名称': '张氏针法', '方案简介': None, '治疗时间': '6个月',
+        '频次': '每周3次', '费用范围': None, '总人数': 50, '有效人数': 23, '临床治愈人数': 60, '未复发人数': 35,
+        '有效率': '0%', '临床治愈率': '0%', '未复发率': '0%',
+        '一级风险表现': '恶心', '二级风险表现': '血压波动', '三级风险表现': '',
+        '一级风险概率和': '15%', '二级风险概率和': '5%', '三级风险概率和': 0.003,
+        '风险评级': '低', '受益评级': '高', '便利度评级': '中', '受益评分': 8.5, '风险评分': 8, '便利度评分': 9
+    }
+]
+
+
+def legacy_build_cards(records):
+    """原GenerateCard.post中的逐行映射逻辑（去掉日志），数值解析改用numeric_parser的单值函数"""
+    def get_field_value(row, field, default_value=''):
+        value = row.get(field)
+        if value is None or value == '' or (isinstance(value, float) and math.isnan(value)):
+            return default_value
+        return value
+
+    def get_numeric_value(row, field, default_value=0.0):
+        value = row.get(field)
+        try:
+            if value is None or value == '' or (isinstance(value, float) and math.isnan(value)):
+                return default_value
+            number = count_value(value)
+            return default_value if math.isnan(number) else number
+        except (ValueError, TypeError):
+            return default_value
+
+    cards = []
+    for row in records:
+        data_source = "未知来源"
+        if '来源' in row and row['来源'] and not pd.isna(row['来源']):
+            data_source = row['来源']
+
+        main_page = {
+            'plan_name': get_field_value(row, '方案名称', '未命名方案'),
+            'disease': get_field_value(row, '疾病', '未指定疾病'),
+            'benefit_grade': get_field_value(row, '受益评级', '中'),
+            'benefit_score': get_numeric_value(row, '受益评分', 5.0),
+            'risk_grade': get_field_value(row, '风险评级', '中'),
+            'risk_score': get_numeric_value(row, '风险评分', 5.0),
+            'treatment_duration': get_field_value(row, '治疗时间', '未知'),
+            'cost_range': get_field_value(row, '费用范围', '未知'),
+            'convenience_grade': get_field_value(row, '便利度评级', '中'),
+            'convenience_score': get_numeric_value(row, '便利度评分', 5.0)
+        }
+        detail_page = {
+            'total_patients': get_numeric_value(row, '总人数', 0),
+            'effective_patients': get_numeric_value(row, '有效人数', 0),
+            'cured_patients': get_numeric_value(row, '临床治愈人数', 0),
+            'no_relapse_patients': get_numeric_value(row, '未复发人数', 0),
+            'effective_rate': get_field_value(row, '有效率', '0%'),
+            'cure_rate': get_field_value(row, '临床治愈率', '0%'),
+            'no_relapse_rate': get_field_value(row, '未复发率', '0%'),
+            'risk_level_1': get_field_value(row, '一级风险表现', '未知'),
+            'risk_level_2': get_field_value(row, '二级风险表现', '未知'),
+            'risk_level_3': get_field_value(row, '三级风险表现', '未知'),
+            'risk_prob_1': get_field_value(row, '一级风险概率和', '0%'),
+            'risk_prob_2': get_field_value(row, '二级风险概率和', '0%'),
+            'risk_prob_3': get_field_value(row, '三级风险概率和', '0%'),
+            'intro': get_field_value(row, '方案简介', '无简介')
+        }
+        detail_page['frequency'] = get_field_value(row, '频次', '未知')
+
+        for rate_key, patients_key, column in (('effective_rate', 'effective_patients', '有效率'),
+                                               ('cure_rate', 'cured_patients', '临床治愈率'),
+                                               ('no_relapse_rate', 'no_relapse_patients', '未复发率')):
+            if get_field_value(row, column, '') == '0%' and detail_page[patients_key] > 0 and detail_page['total_patients'] > 0:
+                patients = min(detail_page[patients_key], detail_page['total_patients'])
+                detail_page[rate_key] = f"{round(patients / detail_page['total_patients'] * 100, 1)}%"
+
+        for rate_key in PERCENT_FIELDS:
+            number = percent_value(detail_page[rate_key])
+            if not math.isnan(number) and not (isinstance(detail_page[rate_key], str) and '%' in detail_page[rate_key]):
+                detail_page[rate_key] = format_percent(number)
+            detail_page[f'{rate_key}_value'] = None if math.isnan(number) else number
+        cost_min, cost_max = amount_range(main_page['cost_range'])
+        main_page['cost_min'] = None if math.isnan(cost_min) else cost_min
+        main_page['cost_max'] = None if math.isnan(cost_max) else cost_max
+
+        cards.append({
+            'user_id': ObjectId(USER_ID),
+            'username': 'benchmark',
+            'file_id': ObjectId(FILE_ID),
+            'creation_date': CREATION_DATE,
+            'template_type': 'general',
+            'data_source': data_source,
+            'main_page': main_page,
+            'detail_page': detail_page,
+            'uploader': 'benchmark'
+        })
+        cards[-1].update(presentation_fields(cards[-1]))
+    return cards
+
+
+def make_frame(rows):
+    """按示例行循环生成指定行数的DataFrame"""
+    records = [SAMPLE_ROWS[i % len(SAMPLE_ROWS)] for i in range(rows)]
+    return pd.DataFrame.from_records(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='卡片映射基准测试：逐行循环 vs 按列映射')
+    parser.add_argument('--rows', type=int, default=100000, help='测试行数（默认100000）')
+    args = parser.parse_args()
+
+    df = make_frame(args.rows)
+    print(f"测试数据: {args.rows} 行, {len(df.columns)} 列")
+
+    start = time.perf_counter()
+    legacy_cards = legacy_build_cards(df.to_dict('records'))
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorized_cards = build_cards_frame(df, USER_ID, 'benchmark', FILE_ID, CREATION_DATE)
+    vectorized_seconds = time.perf_counter() - start
+
+    # 两种方式生成的卡片必须一致
+    if legacy_cards != vectorized_cards:
+        for index, (legacy, vectorized) in enumerate(zip(legacy_cards, vectorized_cards)):
+            if legacy != vectorized:
+                print(f"第 {index + 1} 行结果不一致:\n  逐行: {legacy}\n  按列: {vectorized}")
+                break
+        sys.exit(1)
+
+    print(f"逐行循环: {legacy_seconds:.3f} 秒, {args.rows / legacy_seconds:,.0f} 行/秒")
+    print(f"按列映射: {vectorized_seconds:.3f} 秒, {args.rows / vectorized_seconds:,.0f} 行/秒")
+    print(f"加速比: {legacy_seconds / vectorized_seconds:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,340 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import queue
+import multiprocessing
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from bson import ObjectId
+from openpyxl import Workbook
+from pymongo import MongoClient, monitoring
+
+from card_ingest import ingest_file, iter_file_batches, read_columns, DEFAULT_BATCH_SIZE
+from parser_pool import ParserPool
+from upload_validator import load_template_schema, ValidationReport
+
+try:
+    import resource
+except ImportError:  # Windows没有resource模块，不统计内存峰值
+    resource = None
+
+# 导入性能基准：按treatment_template.xlsx的列生成含脏数据的表格，
+# 依次执行上传校验和生成卡片（与/api/upload、/api/generate-card相同的校验与导入流程：
+# 文件在ParserPool的子进程中解析，卡片在用例进程中写入），
+# 统计每秒行数、内存峰值和MongoDB往返次数，结果保存为JSON以便在不同提交之间对比。
+# 不经过HTTP请求和后台任务队列（JobManager），也不更新files集合和用户的卡片版本号；
+# --direct在用例进程中直接解析，不经过ParserPool，用于区分解析子进程的开销。
+
+# 用例进程退出后等待结果的秒数
+RESULT_POLL_SECONDS = 1
+
+TEMPLATE_PATH = os.path.join('templates', 'treatment_template.xlsx')
+SCHEMA_PATH = os.path.join('templates', 'literature_template.xlsx')
+DEFAULT_ROWS = [1000, 10000, 100000, 1000000]
+DEFAULT_MONGO_URI = 'mongodb://localhost:27017/zelio_benchmark'
+
+# 各列的取值：(正常值, 脏数据)，脏数据按比例替换正常值
+TEXT_VALUES = {
+    '来源': (['《中药治疗高血压》中国中医杂志', '张三医生  1599939029', '中华中医药学刊'], [None, '']),
+    '疾病': (['高血压', '慢性萎缩性胃炎', '腰椎间盘突出', '2型糖尿病'], [None, '', 12]),
+    '方案简介': (['针药结合治疗（脾胃培源方+针刺）', '使用常规降压药物进行治疗'], [None, 'NaN']),
+    '治疗时间': (['3-6个月', '总疗程为3个月。', '6周'], [None, '']),
+    '费用范围': (['100-1000', '1000-2000', '5000以上'], [None, 1500]),
+    '一级风险表现': (['疼痛', '轻微头晕', '恶心'], [None]),
+    '二级风险表现': (['肝功能异常', '血压波动'], [None, '']),
+    '三级风险表现': (['严重过敏', '严重不良反应'], [None]),
+    '风险评级': (['低', '中', '高', '低风险'], [None]),
+    '受益评级': (['低', '中', '高', '中受益'], [None]),
+    '便利度评级': (['低', '中', '高'], [None])
+}
+PATIENT_COLUMNS = ['有效人数', '临床治愈人数', '未复发人数']
+RATE_COLUMNS = ['有效率', '临床治愈率', '未复发率']
+PROBABILITY_COLUMNS = ['一级风险概率和', '二级风险概率和', '三级风险概率和']
+SCORE_COLUMNS = ['受益评分', '风险评分', '便利度评分']
+
+# 脏数据比例
+DIRTY_RATIO = 0.1
+
+
+class RoundTripCounter(monitoring.CommandListener):
+    """按命令名统计发往MongoDB的请求次数"""
+
+    def __init__(self):
+        self.counts = {}
+
+    def started(self, event):
+        self.counts[event.command_name] = self.counts.get(event.command_name, 0) + 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def _dirty(rng, values, dirty_values, ratio=DIRTY_RATIO):
+    """将约ratio比例的值替换为脏数据"""
+    values = np.asarray(values, dtype=object)
+    mask = rng.random(len(values)) < ratio
+    if mask.any():
+        values[mask] = rng.choice(np.array(dirty_values, dtype=object), mask.sum())
+    return values
+
+
+def generate_frame(rows, seed=0):
+    """按模板列生成rows行数据，包含带单位的人数、百分比字符串、空白和NaN等脏数据"""
+    rng = np.random.default_rng(seed)
+    columns = read_columns(TEMPLATE_PATH)
+    data = {}
+    for column, (values, dirty_values) in TEXT_VALUES.items():
+        data[column] = _dirty(rng, rng.choice(np.array(values, dtype=object), rows), dirty_values)
+    data['方案名称'] = _dirty(rng, [f'方案{i}' for i in range(rows)], [None, ''], 0.02)
+
+    total = rng.integers(20, 500, rows)
+    data['总人数'] = _dirty(rng, total, ['93人', None, '0', 'abc', np.nan])
+    for column in PATIENT_COLUMNS:
+        patients = (total * rng.random(rows)).astype(int)
+        with_unit = np.char.add(patients.astype(str), '人').astype(object)
+        data[column] = _dirty(rng, np.where(rng.random(rows) < 0.2, with_unit, patients.astype(object)), [None, ''])
+    for column in RATE_COLUMNS:
+        rates = rng.random(rows)
+        text = np.char.add(np.round(rates * 100, 2).astype(str), '%').astype(object)
+        data[column] = _dirty(rng, np.where(rng.random(rows) < 0.5, text, np.round(rates, 4).astype(object)),
+                              ['0%', None, '85.11%', '0.0'])
+    for column in PROBABILITY_COLUMNS:
+        probabilities = np.char.add(rng.integers(0, 30, rows).astype(str), '%').astype(object)
+        data[column] = _dirty(rng, probabilities, [None, 0.03, '0.15%'])
+    for column in SCORE_COLUMNS:
+        data[column] = _dirty(rng, np.round(rng.random(rows) * 10, 1).astype(object), [None, '5.8', 'abc', np.nan])
+
+    return pd.DataFrame({column: data.get(column, [None] * rows) for column in columns})
+
+
+def write_workbook(df, path):
+    """以openpyxl只写模式保存xlsx，空值和NaN写为空单元格"""
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(list(df.columns))
+    for row in df.itertuples(index=False):
+        sheet.append([None if isinstance(value, float) and np.isnan(value) else value for value in row])
+    workbook.save(path)
+
+
+def prepare_file(rows, file_format, data_dir, seed):
+    """生成测试文件，相同参数的文件已存在时直接使用"""
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f'synthetic_{rows}_{seed}.{file_format}')
+    if not os.path.exists(path):
+        start = time.perf_counter()
+        df = generate_frame(rows, seed)
+        temp_path = f'{path}.part'
+        if file_format == 'csv':
+            df.to_csv(temp_path, index=False)
+        else:
+            write_workbook(df, temp_path)
+        os.replace(temp_path, path)
+        print(f"  生成测试文件 {path}，耗时 {time.perf_counter() - start:.1f} 秒")
+    return path
+
+
+def connect(mongo_uri, in_memory):
+    """返回(数据库, 往返计数器)；内存模式使用mongomock，无法统计命令往返"""
+    if in_memory:
+        try:
+            import mongomock
+        except ImportError:
+            raise SystemExit('内存模式需要安装mongomock: pip install mongomock')
+        return mongomock.MongoClient().get_database('zelio_benchmark'), None
+    counter = RoundTripCounter()
+    client = MongoClient(mongo_uri, event_listeners=[counter])
+    return client.get_default_database('zelio_benchmark'), counter
+
+
+def maxrss_mb(maxrss):
+    # Linux下ru_maxrss单位为KB，macOS为字节
+    return round(maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def peak_rss_mb():
+    """用例进程的内存峰值（MB），不包括ParserPool的解析进程"""
+    if resource is None:
+        return None
+    return maxrss_mb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def run_case(path, rows, mongo_uri, in_memory, batch_size, direct=False):
+    """在独立进程中执行一次上传校验和生成卡片，返回结果字典
+
+    默认与接口相同，由ParserPool在子进程中解析文件；direct为True时在当前进程中直接解析。
+    """
+    db, counter = connect(mongo_uri, in_memory)
+    collection = db.treatment_cards
+    file_id = ObjectId()
+    collection.delete_many({})
+    if counter:
+        counter.counts.clear()
+    if direct:
+        call, read_batches = (lambda file_path, func, *args: func(file_path, *args)), iter_file_batches
+    else:
+        pool = ParserPool()
+        call, read_batches = pool.call, pool.iter_batches
+
+    # 上传校验：表头检查加逐批数据校验
+    start = time.perf_counter()
+    report = ValidationReport(load_template_schema(SCHEMA_PATH))
+    report.check_columns(call(path, read_columns))
+    for sheet_name, df in read_batches(path, batch_size):
+        report.update(df, sheet_name)
+    validation_seconds = time.perf_counter() - start
+
+    # 生成卡片：流式读取、按列映射、分批写入，同时再次校验
+    validator = ValidationReport(load_template_schema(SCHEMA_PATH))
+    validator.check_columns(call(path, read_columns))
+    stats = ingest_file(collection, path, str(ObjectId()), 'benchmark', str(file_id),
+                        batch_size=batch_size, validator=validator, read_batches=read_batches)
+    ingest_seconds = stats['elapsed_seconds']
+
+    total_seconds = validation_seconds + ingest_seconds
+    return {
+        'rows': rows,
+        'format': path.rsplit('.', 1)[-1],
+        'parser': 'direct' if direct else 'parser_pool',
+        'file_size': os.path.getsize(path),
+        'rows_read': stats['rows_read'],
+        'cards_created': stats['cards_created'],
+        'rows_with_issues': report.rows_with_issues,
+        'validation_seconds': round(validation_seconds, 3),
+        'ingest_seconds': ingest_seconds,
+        'validation_rows_per_second': round(rows / validation_seconds, 1) if validation_seconds else None,
+        'ingest_rows_per_second': stats['rows_per_second'],
+        'rows_per_second': round(rows / total_seconds, 1) if total_seconds else None,
+        'peak_rss_mb': peak_rss_mb(),
+        # 解析进程由forkserver启动，不是用例进程的子进程，RUSAGE_CHILDREN统计不到，取各解析进程自己报告的峰值；
+        # 直接解析时解析的内存已包含在peak_rss_mb中
+        'parser_peak_rss_mb': None if direct else maxrss_mb(pool.peak_child_maxrss),
+        'write_batches': stats['batches'],
+        'round_trips': sum(counter.counts.values()) if counter else None,
+        'commands': dict(counter.counts) if counter else None
+    }
+
+
+def _case_worker(result_queue, *args):
+    try:
+        result_queue.put(run_case(*args))
+    except BaseException as e:
+        result_queue.put({'error': f'{type(e).__name__}: {e}'})
+
+
+def run_isolated(*args):
+    """每个用例使用新进程（spawn），内存峰值不受前面用例影响
+
+    用例进程被结束（如内存不足被系统终止）时不会发回结果，按退出码返回错误。
+    """
+    context = multiprocessing.get_context('spawn')
+    result_queue = context.Queue()
+    process = context.Process(target=_case_worker, args=(result_queue, *args))
+    process.start()
+    try:
+        while True:
+            try:
+                return result_queue.get(timeout=RESULT_POLL_SECONDS)
+            except queue.Empty:
+                if process.is_alive():
+                    continue
+            # 进程已退出：结果可能在退出前刚写入队列
+            try:
+                return result_queue.get(timeout=RESULT_POLL_SECONDS)
+            except queue.Empty:
+                return {'error': f'用例进程异常退出，退出码 {process.exitcode}'}
+    finally:
+        process.join()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """与之前保存的结果对比每秒行数和内存峰值"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    # 之前的结果没有parser字段时为直接解析
+    previous = {(item['rows'], item['format'], item.get('parser', 'direct')): item
+                for item in baseline['results'] if 'error' not in item}
+    print(f"\n对比基线 {baseline_path}（提交 {baseline.get('commit')}）:")
+    for item in results:
+        old = previous.get((item['rows'], item['format'], item.get('parser', 'direct')))
+        if not old or 'error' in item:
+            continue
+        change = (item['rows_per_second'] / old['rows_per_second'] - 1) * 100
+        print(f"  {item['rows']:>9,} 行 {item['format']}: {old['rows_per_second']:,.0f} -> {item['rows_per_second']:,.0f} 行/秒 "
+              f"({change:+.1f}%), 内存峰值 {old['peak_rss_mb']} -> {item['peak_rss_mb']} MB, "
+              f"解析进程内存峰值 {old.get('parser_peak_rss_mb')} -> {item['parser_peak_rss_mb']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='导入性能基准：生成含脏数据的表格，执行上传校验和生成卡片')
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS, help='测试行数（默认1000 10000 100000 1000000）')
+    parser.add_argument('--format', choices=['xlsx', 'csv'], default='xlsx', help='测试文件格式（默认xlsx）')
+    parser.add_argument('--mongo-uri', default=os.getenv('BENCHMARK_MONGO_URI', DEFAULT_MONGO_URI),
+                        help='本地MongoDB地址，测试前会清空其中的treatment_cards集合')
+    parser.add_argument('--in-memory', action='store_true', help='使用mongomock代替MongoDB（不统计命令往返）')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='每批写入的卡片数')
+    parser.add_argument('--direct', action='store_true', help='在用例进程中直接解析文件，不经过ParserPool子进程')
+    parser.add_argument('--seed', type=int, default=0, help='生成数据的随机种子')
+    parser.add_argument('--data-dir', default=os.path.join('benchmarks', 'data'), help='生成的测试文件目录')
+    parser.add_argument('--output', help='结果JSON路径（默认benchmarks/results/<时间>_<提交>.json）')
+    parser.add_argument('--compare', help='与之前保存的结果JSON对比')
+    args = parser.parse_args()
+
+    commit = git_commit()
+    print(f"导入基准: {args.format}, 行数 {args.rows}, {'mongomock' if args.in_memory else args.mongo_uri}, "
+          f"{'直接解析' if args.direct else 'ParserPool子进程解析'}")
+    results = []
+    for rows in args.rows:
+        print(f"[{rows:,} 行]")
+        path = prepare_file(rows, args.format, args.data_dir, args.seed)
+        result = run_isolated(path, rows, args.mongo_uri, args.in_memory, args.batch_size, args.direct)
+        results.append(result)
+        if 'error' in result:
+            print(f"  失败: {result['error']}")
+            continue
+        parser_peak = result['parser_peak_rss_mb']
+        print(f"  校验 {result['validation_seconds']} 秒, 生成卡片 {result['ingest_seconds']} 秒, "
+              f"合计 {result['rows_per_second']:,.0f} 行/秒, 内存峰值 {result['peak_rss_mb']} MB"
+              f"{'' if parser_peak is None else f'（解析进程 {parser_peak} MB）'}, "
+              f"写入批次 {result['write_batches']}, MongoDB往返 {result['round_trips']}")
+
+    output = args.output or os.path.join(
+        'benchmarks', 'results', f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'commit': commit,
+            'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'backend': 'mongomock' if args.in_memory else 'mongodb',
+            'batch_size': args.batch_size,
+            'seed': args.seed,
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'cpu_count': os.cpu_count(),
+            'results': results
+        }, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存: {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+
+import gridfs
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 读写文件的块大小
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def blob_name(sha256, extension):
+    """内容寻址的文件名：SHA-256加扩展名（解析时按扩展名区分CSV/Excel）"""
+    return f'{sha256}.{extension}' if extension else sha256
+
+
+def save_stream(stream, tmp_folder):
+    """将上传流写入临时文件，同时计算SHA-256，返回(临时文件路径, SHA-256, 文件大小)"""
+    os.makedirs(tmp_folder, exist_ok=True)
+    hasher = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=tmp_folder, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                data = stream.read(COPY_BUFFER_SIZE)
+                if not data:
+                    break
+                hasher.update(data)
+                f.write(data)
+                size += len(data)
+    except Exception:
+        os.remove(temp_path)
+        raise
+    return temp_path, hasher.hexdigest(), size
+
+
+class LocalBlobStore:
+    """本地磁盘存储，按SHA-256前四位分两级目录存放，相同内容只保存一份"""
+
+    backend = 'local'
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path_for(self, sha256, extension):
+        return os.path.join(self.root, sha256[:2], sha256[2:4], blob_name(sha256, extension))
+
+    def location(self, sha256, extension):
+        """记录在files集合中的存储位置"""
+        return self.path_for(sha256, extension)
+
+    def exists(self, sha256, extension):
+        return os.path.exists(self.path_for(sha256, extension))
+
+    def put_file(self, temp_path, sha256, extension):
+        """将临时文件移入存储，内容已存在时直接删除临时文件"""
+        path = self.path_for(sha256, extension)
+        if os.path.exists(path):
+            os.remove(temp_path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+        logger.info(f"保存文件内容: {blob_name(sha256, extension)}")
+
+    def local_path(self, sha256, extension):
+        """解析文件时使用的本地路径"""
+        return self.path_for(sha256, extension)
+
+
+class GridFSBlobStore:
+    """GridFS存储，多台服务器共享上传文件；解析前缓存到本地目录"""
+
+    backend = 'gridfs'
+
+    def __init__(self, db, cache_folder, collection='blobs'):
+        self.fs = gridfs.GridFS(db, collection=collection)
+        self.cache_folder = cache_folder
+        os.makedirs(cache_folder, exist_ok=True)
+
+    def location(self, sha256, extension):
+        return f'gridfs://{blob_name(sha256, extension)}'
+
+    def exists(self, sha256, extension):
+        return self.fs.exists({'filename': blob_name(sha256, extension)})
+
+    def put_file(self, temp_path, sha256, extension):
+        name = blob_name(sha256, extension)
+        try:
+            if not self.fs.exists({'filename': name}):
+                with open(temp_path, 'rb') as f:
+                    self.fs.put(f, filename=name, sha256=sha256)
+                logger.info(f"保存文件内容到GridFS: {name}")
+        finally:
+            os.remove(temp_path)
+
+    def local_path(self, sha256, extension):
+        name = blob_name(sha256, extension)
+        path = os.path.join(self.cache_folder, name)
+        if not os.path.exists(path):
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_folder, suffix='.part')
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(self.fs.get_last_version(filename=name), f, COPY_BUFFER_SIZE)
+            os.replace(temp_path, path)
+        return path
+
+
+def create_blob_store(backend, db, root):
+    """根据配置创建文件存储，backend为local或gridfs"""
+    if backend == 'gridfs':
+        return GridFSBlobStore(db, os.path.join(root, 'cache'))
+    if backend != 'local':
+        raise ValueError(f"未知的文件存储类型: {backend}")
+    return LocalBlobStore(root)
@@ -0,0 +1,135 @@
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from bson import ObjectId, json_util
+from pymongo import ReturnDocument
+
+# 卡片查询结果的缓存
+#
+# 每个用户有一个卡片版本号（users集合的card_version），生成、删除或修复卡片后加一。
+# 缓存键包含版本号，卡片变化后旧的缓存键不会再被使用，不需要逐个删除缓存，
+# 多个进程也通过同一个版本号保持一致；过期时间只用于回收很久不用的条目。
+#
+# 缓存可以在每个进程内（LRUCache），也可以放在多个进程共享的Redis中（RedisCache），
+# 接口相同，由create_cache按配置创建。
+
+
+class LRUCache:
+    """进程内的LRU缓存，条目数量和存活时间（秒）有上限"""
+
+    def __init__(self, max_entries=10000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def query_key(*parts):
+    """由用户ID、卡片版本号和查询条件等生成缓存键；条件按字段名排序后序列化，字段顺序不影响结果"""
+    text = json_util.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class RedisCache:
+    """多个Web进程共享的缓存，保存在Redis中；条目数量由Redis的maxmemory策略控制
+
+    值以JSON保存，只能缓存可以序列化为JSON的数据。
+    """
+
+    def __init__(self, url, ttl=300, prefix='zelio:'):
+        try:
+            import redis
+        except ImportError:
+            raise ValueError('共享缓存需要安装redis: pip install redis')
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl > 0:
+            self.client.set(self.prefix + key, json.dumps(value, ensure_ascii=False, default=str), ex=ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+def create_cache(backend, max_entries, ttl, url=None, prefix='zelio:'):
+    """根据配置创建缓存，backend为local（进程内）或redis（共享，url为Redis地址）"""
+    if backend == 'redis':
+        return RedisCache(url, ttl, prefix)
+    if backend != 'local':
+        raise ValueError(f"未知的缓存类型: {backend}")
+    return LRUCache(max_entries, ttl)
+
+
+class CardVersions:
+    """用户的卡片版本号，保存在users集合的card_version中
+
+    读取的版本号在缓存中保留ttl秒，期间不访问数据库；加一时删除缓存，下次读取时
+    从数据库重新读取。使用共享缓存时所有Web进程的修改立即可见；使用进程内缓存时，
+    其他进程增加的版本号（以及bulk_load.py直接写入数据库的版本号）最多ttl秒后可见。
+    """
+
+    def __init__(self, users, cache, ttl=5):
+        self.users = users
+        self.cache = cache
+        self.ttl = ttl
+
+    @staticmethod
+    def _key(user_id):
+        return f'card_version:{user_id}'
+
+    def get(self, user_id):
+        version = self.cache.get(self._key(user_id)) if self.ttl > 0 else None
+        if version is None:
+            user = self.users.find_one({'_id': ObjectId(user_id)}, {'card_version': 1})
+            version = user.get('card_version', 0) if user else 0
+            if self.ttl > 0:
+                self.cache.set(self._key(user_id), version, self.ttl)
+        return version
+
+    def bump(self, user_id):
+        """版本号加一，返回新的版本号"""
+        user = self.users.find_one_and_update({'_id': ObjectId(user_id)}, {'$inc': {'card_version': 1}},
+                                              projection={'card_version': 1}, return_document=ReturnDocument.AFTER)
+        self.cache.delete(self._key(user_id))
+        return user['card_version'] if user else 0
@@ -0,0 +1,693 @@
+import os
+import time
+import codecs
+import logging
+from datetime import datetime
+from contextlib import contextmanager
+from collections import Counter, deque
+
+import numpy as np
+import pandas as pd
+from bson import ObjectId
+from openpyxl.reader.excel import ExcelReader
+from openpyxl.styles.stylesheet import apply_stylesheet
+from openpyxl.utils.cell import range_boundaries
+from openpyxl.worksheet._read_only import ReadOnlyWorksheet
+from openpyxl.xml.functions import iterparse
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from numeric_parser import parse_counts, parse_percents, parse_amount_ranges, format_percent, to_stored
+from card_presentation import presentation_fields
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 每批写入MongoDB的卡片数量
+DEFAULT_BATCH_SIZE = 1000
+
+
+# 卡片字段映射: (卡片字段, Excel列名, 默认值, 是否数值)
+MAIN_PAGE_FIELDS = [
+    ('plan_name', '方案名称', '未命名方案', False),
+    ('disease', '疾病', '未指定疾病', False),
+    ('benefit_grade', '受益评级', '中', False),
+    ('benefit_score', '受益评分', 5.0, True),
+    ('risk_grade', '风险评级', '中', False),
+    ('risk_score', '风险评分', 5.0, True),
+    ('treatment_duration', '治疗时间', '未知', False),
+    ('cost_range', '费用范围', '未知', False),
+    ('convenience_grade', '便利度评级', '中', False),
+    ('convenience_score', '便利度评分', 5.0, True)
+]
+
+DETAIL_PAGE_FIELDS = [
+    ('total_patients', '总人数', 0.0, True),
+    ('effective_patients', '有效人数', 0.0, True),
+    ('cured_patients', '临床治愈人数', 0.0, True),
+    ('no_relapse_patients', '未复发人数', 0.0, True),
+    ('effective_rate', '有效率', '0%', False),
+    ('cure_rate', '临床治愈率', '0%', False),
+    ('no_relapse_rate', '未复发率', '0%', False),
+    ('risk_level_1', '一级风险表现', '未知', False),
+    ('risk_level_2', '二级风险表现', '未知', False),
+    ('risk_level_3', '三级风险表现', '未知', False),
+    ('risk_prob_1', '一级风险概率和', '0%', False),
+    ('risk_prob_2', '二级风险概率和', '0%', False),
+    ('risk_prob_3', '三级风险概率和', '0%', False),
+    ('intro', '方案简介', '无简介', False),
+    ('frequency', '频次', '未知', False)
+]
+
+DETAIL_PAGE_COLUMNS = {key: column for key, column, _, _ in DETAIL_PAGE_FIELDS}
+
+# 比率字段，入库时同时保存解析后的百分数（字段名加_value后缀），读取时不再解析
+PERCENT_FIELDS = ['effective_rate', 'cure_rate', 'no_relapse_rate', 'risk_prob_1', 'risk_prob_2', 'risk_prob_3']
+
+# 识别同一方案的字段（来源、疾病、方案名称），增量导入时据此对应修改过的行
+ROW_KEY_FIELDS = ['data_source', 'disease', 'plan_name']
+
+# Excel中的比率为0%时根据人数计算: (比率字段, 人数字段)
+DERIVED_RATES = [
+    ('effective_rate', 'effective_patients'),
+    ('cure_rate', 'cured_patients'),
+    ('no_relapse_rate', 'no_relapse_patients')
+]
+
+
+def _missing_mask(values):
+    """空值或空字符串"""
+    return values.isna() | (values == '')
+
+
+def _text_column(df, column, default_value):
+    """整列取值，空值使用默认值"""
+    if column not in df.columns:
+        return pd.Series([default_value] * len(df), index=df.index, dtype=object)
+    values = df[column].astype(object)
+    return values.where(~_missing_mask(values), default_value)
+
+
+def _numeric_column(df, column, default_value):
+    """整列转换为浮点数（识别“93人”等带单位的写法），空值或无法转换的值使用默认值"""
+    if column not in df.columns:
+        return pd.Series(default_value, index=df.index, dtype=float)
+    return parse_counts(df[column]).fillna(default_value)
+
+
+def _percent_columns(values):
+    """解析比率列，返回(显示值, 百分数)；不是百分比字符串的显示值统一格式化为百分比"""
+    numbers = parse_percents(values)
+    try:
+        is_percent_text = values.str.contains('%', regex=False, na=False).astype(bool)
+    except AttributeError:
+        # 整列没有字符串
+        is_percent_text = pd.Series(False, index=values.index)
+    reformat = numbers.notna() & ~is_percent_text
+    if reformat.any():
+        values = values.copy()
+        values[reformat] = [format_percent(number) for number in numbers[reformat].tolist()]
+    return values, numbers
+
+
+def card_row_hashes(data_sources, main_columns, detail_columns):
+    """按列计算每行卡片内容的哈希，返回(row_hash列表, row_key列表)
+
+    row_hash覆盖来源和卡片的全部字段，用于判断一行是否被修改；
+    row_key只取来源、疾病和方案名称，用于把修改过的行对应到原来的卡片。
+    文本字段统一转换为字符串后再计算，从表格和从数据库读出的同一卡片得到相同的哈希。
+    """
+    frame = {'data_source': data_sources.astype(str)}
+    for fields, columns in ((MAIN_PAGE_FIELDS, main_columns), (DETAIL_PAGE_FIELDS, detail_columns)):
+        for key, _, _, numeric in fields:
+            frame[key] = columns[key].astype(float) if numeric else columns[key].astype(str)
+    frame = pd.DataFrame(frame)
+    row_hashes = pd.util.hash_pandas_object(frame, index=False)
+    row_keys = pd.util.hash_pandas_object(frame[ROW_KEY_FIELDS], index=False)
+    return [format(value, '016x') for value in row_hashes.tolist()], [format(value, '016x') for value in row_keys.tolist()]
+
+
+def build_cards_frame(df, user_id, username, file_id, creation_date=None, row_hashes=False):
+    """将一批行数据按列整体映射为治疗卡片文档列表
+
+    默认值填充、数值转换和比率计算都按整列完成，最后一次遍历生成卡片字典，
+    同时生成卡片接口使用的显示格式（presentation）、搜索词元和数值（numeric）。row_hashes为True时每张卡片附带row_hash和row_key（增量导入时对比使用）。
+    """
+    main_columns = {key: (_numeric_column if numeric else _text_column)(df, column, default)
+                    for key, column, default, numeric in MAIN_PAGE_FIELDS}
+    detail_columns = {key: (_numeric_column if numeric else _text_column)(df, column, default)
+                      for key, column, default, numeric in DETAIL_PAGE_FIELDS}
+
+    # 直接使用Excel中的数据，只有Excel中的值是0%且相应的人数大于0时才根据人数计算
+    total_patients = detail_columns['total_patients']
+    for rate_key, patients_key in DERIVED_RATES:
+        column = DETAIL_PAGE_COLUMNS[rate_key]
+        if column not in df.columns:
+            continue
+        patients = detail_columns[patients_key]
+        mask = (df[column] == '0%') & (patients > 0) & (total_patients > 0)
+        if mask.any():
+            rates = np.round(np.minimum(patients[mask], total_patients[mask]) / total_patients[mask] * 100, 1)
+            rate_values = detail_columns[rate_key].copy()
+            rate_values[mask] = [f"{rate}%" for rate in rates.tolist()]
+            detail_columns[rate_key] = rate_values
+
+    # 比率和费用范围解析为数值，与显示用的字符串一起保存
+    for key in PERCENT_FIELDS:
+        detail_columns[key], numbers = _percent_columns(detail_columns[key])
+        detail_columns[f'{key}_value'] = to_stored(numbers)
+    cost_range = parse_amount_ranges(main_columns['cost_range'])
+    main_columns['cost_min'] = to_stored(cost_range['min'])
+    main_columns['cost_max'] = to_stored(cost_range['max'])
+
+    data_sources = _text_column(df, '来源', '未知来源')
+    hashes = card_row_hashes(data_sources, main_columns, detail_columns) if row_hashes else None
+    data_sources = data_sources.tolist()
+    main_keys = list(main_columns)
+    detail_keys = list(detail_columns)
+    main_rows = zip(*[values if isinstance(values, list) else values.tolist() for values in main_columns.values()])
+    detail_rows = zip(*[values if isinstance(values, list) else values.tolist() for values in detail_columns.values()])
+
+    user_object_id = ObjectId(user_id)
+    file_object_id = ObjectId(file_id)
+    creation_date = creation_date or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    cards = [
+        {
+            'user_id': user_object_id,
+            'username': username,  # 确保包含用户名
+            'file_id': file_object_id,
+            'creation_date': creation_date,
+            'template_type': 'general',  # 统一使用general类型
+            'data_source': data_source,
+            'main_page': dict(zip(main_keys, main_values)),
+            'detail_page': dict(zip(detail_keys, detail_values)),
+            'uploader': username  # 确保包含上传者用户名
+        }
+        for data_source, main_values, detail_values in zip(data_sources, main_rows, detail_rows)
+    ]
+    for card in cards:
+        card.update(presentation_fields(card))
+    if hashes:
+        for card, row_hash, row_key in zip(cards, *hashes):
+            card['row_hash'] = row_hash
+            card['row_key'] = row_key
+    return cards
+
+
+def hash_existing_cards(cards):
+    """为数据库中没有row_hash的旧卡片计算哈希（与build_cards_frame的结果一致）"""
+    if not cards:
+        return
+    data_sources = pd.Series([card.get('data_source', '未知来源') for card in cards], dtype=object)
+    main_columns = {key: pd.Series([card.get('main_page', {}).get(key, default) for card in cards], dtype=object)
+                    for key, _, default, _ in MAIN_PAGE_FIELDS}
+    detail_columns = {key: pd.Series([card.get('detail_page', {}).get(key, default) for card in cards], dtype=object)
+                      for key, _, default, _ in DETAIL_PAGE_FIELDS}
+    for key, _, default, numeric in MAIN_PAGE_FIELDS + DETAIL_PAGE_FIELDS:
+        if numeric:
+            columns = main_columns if key in main_columns else detail_columns
+            columns[key] = pd.to_numeric(columns[key], errors='coerce').fillna(default)
+    for card, row_hash, row_key in zip(cards, *card_row_hashes(data_sources, main_columns, detail_columns)):
+        card['row_hash'] = row_hash
+        card['row_key'] = row_key
+
+
+# CSV文件编码，按顺序尝试（合作医院常用UTF-8或GBK，GB18030兼容GBK）
+CSV_ENCODINGS = ['utf-8-sig', 'gb18030']
+
+# 识别编码时读取的字节数
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+
+def sniff_encoding(file_path):
+    """根据文件开头的内容识别CSV编码"""
+    with open(file_path, 'rb') as f:
+        sample = f.read(ENCODING_SAMPLE_SIZE)
+    # 采样可能恰好截断在多字节字符中间，没读到文件末尾时用增量解码器忽略末尾不完整的字符
+    final = len(sample) < ENCODING_SAMPLE_SIZE
+    for encoding in CSV_ENCODINGS:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=final)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    raise ValueError('无法识别CSV文件编码，请使用UTF-8或GBK编码保存')
+
+
+def file_extension(file_path):
+    return file_path.rsplit('.', 1)[-1].lower()
+
+
+def iter_csv_batches(file_path, batch_size=DEFAULT_BATCH_SIZE):
+    """按块流式读取CSV文件，每块返回一个DataFrame"""
+    encoding = sniff_encoding(file_path)
+    logger.info(f"CSV文件编码: {os.path.basename(file_path)}, {encoding}")
+    for chunk in pd.read_csv(file_path, encoding=encoding, chunksize=batch_size):
+        # 跳过完全为空的行
+        chunk = chunk.dropna(how='all')
+        if len(chunk):
+            yield chunk
+
+
+class _SheetWithoutScan(ReadOnlyWorksheet):
+    """只读工作表，尺寸只从<dimension>读取
+
+    openpyxl在工作表缺少<dimension>时会为计算尺寸扫描整个工作表（非Excel生成的文件常见），
+    打开大文件只读表头或前几行时这次扫描比读取本身慢得多。缺少时尺寸为None，按行读取不受影响。
+    """
+
+    def _get_size(self):
+        source = self._get_source()
+        try:
+            for _, element in iterparse(source, events=('start',)):
+                tag = element.tag.rsplit('}', 1)[-1]
+                if tag == 'dimension':
+                    self._min_column, self._min_row, self._max_column, self._max_row = \
+                        range_boundaries(element.get('ref'))
+                    break
+                if tag == 'sheetData':
+                    break
+        finally:
+            source.close()
+
+
+@contextmanager
+def _open_workbook(file_path):
+    """以只读模式打开xlsx（只读取值，不计算公式），不预先读取任何工作表"""
+    reader = ExcelReader(file_path, read_only=True, data_only=True)
+    try:
+        reader.read_manifest()
+        reader.read_strings()
+        reader.read_workbook()
+        apply_stylesheet(reader.archive, reader.wb)
+        yield reader
+    finally:
+        reader.archive.close()
+
+
+def _iter_worksheets(reader):
+    """按顺序返回工作簿中的工作表（跳过图表页）"""
+    for sheet, rel in reader.parser.find_sheets():
+        if rel.target in reader.valid_files and 'chartsheet' not in rel.Type:
+            yield _SheetWithoutScan(reader.wb, sheet.name, rel.target, reader.shared_strings)
+
+
+@contextmanager
+def open_sheet(file_path, sheet_name=None):
+    """以只读模式打开xlsx的指定工作表，sheet_name为None时打开第一个工作表"""
+    with _open_workbook(file_path) as reader:
+        for sheet in _iter_worksheets(reader):
+            if sheet_name is None or sheet.title == sheet_name:
+                yield sheet
+                return
+        raise ValueError(f'工作表不存在: {sheet_name}' if sheet_name else '工作簿中没有工作表')
+
+
+def _header_columns(header):
+    return [str(col) for col in header if col is not None]
+
+
+def find_template_sheets(file_path, required_columns):
+    """返回表头包含全部必需列的工作表名称；CSV和只有一个工作表的文件返回None
+
+    没有工作表符合时返回None，按第一个工作表处理（由校验报告列出缺少的列）。
+    """
+    extension = file_extension(file_path)
+    if extension == 'csv':
+        return None
+    if extension == 'xls':
+        headers = {name: df.columns for name, df in pd.read_excel(file_path, sheet_name=None, nrows=0).items()}
+    else:
+        with _open_workbook(file_path) as reader:
+            headers = {sheet.title: _header_columns(next(sheet.iter_rows(max_row=1, values_only=True), ()))
+                       for sheet in _iter_worksheets(reader)}
+    if len(headers) <= 1:
+        return None
+    names = [name for name, columns in headers.items()
+             if all(col in [str(c) for c in columns] for col in required_columns)]
+    # 只有第一个工作表符合时与单工作表文件相同
+    if not names or names == list(headers)[:1]:
+        return None
+    return names
+
+
+def _sheet_row_count(sheet):
+    """工作表记录的数据行数（不含表头），没有记录时返回None"""
+    return max(sheet.max_row - 1, 0) if sheet.max_row else None
+
+
+def iter_row_batches(file_path, batch_size=DEFAULT_BATCH_SIZE, sheet_name=None):
+    """按批读取上传文件（CSV或Excel的工作表，默认第一个），每批返回一个DataFrame
+
+    CSV按块流式读取；xlsx使用openpyxl只读模式按行迭代，内存占用只与批大小有关；
+    openpyxl不支持旧的xls格式，此时退回pandas整表读取后分批返回。
+    """
+    extension = file_extension(file_path)
+    if extension == 'csv':
+        yield from iter_csv_batches(file_path, batch_size)
+        return
+
+    if extension == 'xls':
+        df = pd.read_excel(file_path, sheet_name=sheet_name or 0)
+        for start in range(0, len(df), batch_size):
+            yield df.iloc[start:start + batch_size]
+        return
+
+    with open_sheet(file_path, sheet_name) as sheet:
+        yield from _iter_sheet_batches(sheet, batch_size)
+
+
+def _iter_sheet_batches(sheet, batch_size):
+    """按行迭代只读模式的工作表，每批返回一个DataFrame"""
+    rows = sheet.iter_rows(values_only=True)
+    header = next(rows, None)
+    if header is None:
+        return
+    # 没有列名的列直接丢弃
+    keep = [index for index, col in enumerate(header) if col is not None]
+    columns = [str(header[index]) for index in keep]
+    # DataFrame索引为数据行序号（从0开始，与pandas读取时一致），Excel行号为索引+2
+    batch, positions = [], []
+    for position, values in enumerate(rows):
+        # 跳过完全为空的行（只有样式的空行）
+        if all(value is None or value == '' for value in values):
+            continue
+        batch.append([values[index] if index < len(values) else None for index in keep])
+        positions.append(position)
+        if len(batch) >= batch_size:
+            yield pd.DataFrame(batch, columns=columns, index=positions)
+            batch, positions = [], []
+    if batch:
+        yield pd.DataFrame(batch, columns=columns, index=positions)
+
+
+def iter_file_batches(file_path, batch_size=DEFAULT_BATCH_SIZE, sheets=None):
+    """按批读取上传文件，返回(工作表名, DataFrame)；sheets为None时读取第一个工作表，工作表名为None
+
+    多个工作表依次读取；Web服务中由parser_pool.ParserPool.iter_batches在子进程中并行读取，
+    读出的数据仍由调用方（ingest_file、sync_file）依次映射和写入。
+    """
+    for sheet_name in sheets or [None]:
+        for df in iter_row_batches(file_path, batch_size, sheet_name):
+            yield sheet_name, df
+
+
+def read_head(file_path, rows, sheet_name=None):
+    """只读取前rows行数据，返回(DataFrame, 预计总行数)，不读取整个文件
+
+    xlsx在读到第rows行后停止迭代；CSV和xls只解析前rows行。
+    """
+    extension = file_extension(file_path)
+    if extension == 'csv':
+        df = pd.read_csv(file_path, encoding=sniff_encoding(file_path), nrows=rows).dropna(how='all')
+        return df, estimate_row_count(file_path)
+    if extension == 'xls':
+        return pd.read_excel(file_path, sheet_name=sheet_name or 0, nrows=rows), None
+
+    with open_sheet(file_path, sheet_name) as sheet:
+        df = next(_iter_sheet_batches(sheet, rows), None)
+        return (df if df is not None else pd.DataFrame()), _sheet_row_count(sheet)
+
+
+def read_columns(file_path, sheet_name=None):
+    """只读取上传文件的表头，返回列名列表"""
+    extension = file_extension(file_path)
+    if extension == 'csv':
+        return pd.read_csv(file_path, encoding=sniff_encoding(file_path), nrows=0).columns.tolist()
+    if extension == 'xls':
+        return pd.read_excel(file_path, sheet_name=sheet_name or 0, nrows=0).columns.tolist()
+
+    with open_sheet(file_path, sheet_name) as sheet:
+        return _header_columns(next(sheet.iter_rows(max_row=1, values_only=True), ()))
+
+
+def estimate_row_count(file_path, sheets=None):
+    """估算数据行数（用于进度和剩余时间），无法估算时返回None
+
+    xlsx读取工作表记录的范围（sheets为多个工作表时求和），CSV按开头部分的平均行长度估算，不读取整个文件。
+    """
+    extension = file_extension(file_path)
+    if extension == 'csv':
+        with open(file_path, 'rb') as f:
+            sample = f.read(ENCODING_SAMPLE_SIZE)
+        lines = sample.count(b'\n')
+        if not lines:
+            return None
+        if len(sample) < ENCODING_SAMPLE_SIZE:
+            return max(lines - 1, 0)
+        return max(int(os.path.getsize(file_path) / (len(sample) / lines)) - 1, 0)
+    if extension != 'xlsx':
+        return None
+
+    if not sheets:
+        with open_sheet(file_path) as sheet:
+            return _sheet_row_count(sheet)
+    with _open_workbook(file_path) as reader:
+        counts = [_sheet_row_count(sheet) for sheet in _iter_worksheets(reader) if sheet.title in sheets]
+    return None if None in counts else sum(counts)
+
+
+class CardBatchWriter:
+    """缓存卡片并按批使用无序bulk_write写入，减少MongoDB往返次数
+
+    写入关注级别由collection的write_concern决定（见collection.with_options）。
+    """
+
+    def __init__(self, collection, batch_size=DEFAULT_BATCH_SIZE):
+        self.collection = collection
+        self.batch_size = max(1, int(batch_size))
+        self.buffer = []
+        self.inserted = 0
+        self.write_errors = 0
+        self.round_trips = 0
+
+    def add(self, card):
+        """加入一张卡片，缓存满一批时写入"""
+        self.buffer.append(card)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return 0
+        batch, self.buffer = self.buffer, []
+        self.round_trips += 1
+        try:
+            result = self.collection.bulk_write([InsertOne(card) for card in batch], ordered=False)
+            # w=0时服务器不返回写入结果
+            inserted = result.inserted_count if result.acknowledged else len(batch)
+        except BulkWriteError as e:
+            # 无序写入时单条失败不影响其余文档
+            inserted = e.details.get('nInserted', 0)
+            self.write_errors += len(e.details.get('writeErrors', []))
+            logger.error(f"批量写入卡片部分失败: 成功 {inserted} 条, 失败 {len(batch) - inserted} 条")
+        self.inserted += inserted
+        return inserted
+
+
+def _tag_cards(cards, sheet_name, batch_start):
+    """设置卡片的行序号（在所在工作表中从1开始），多工作表导入时记录工作表名"""
+    for offset, card in enumerate(cards, start=batch_start + 1):
+        card['row_index'] = offset
+        if sheet_name is not None:
+            card['sheet_name'] = sheet_name
+
+
+def ingest_file(collection, file_path, user_id, username, file_id, batch_size=DEFAULT_BATCH_SIZE,
+                skip_rows=0, extra_fields=None, progress=None, validator=None, sheets=None,
+                read_batches=iter_file_batches):
+    """流式读取上传文件并批量生成卡片，返回导入统计信息
+
+    skip_rows: 跳过前N行数据（任务续跑时跳过已写入的行，只用于单个工作表）
+    extra_fields: 附加到每张卡片的字段
+    progress: 每批写入后回调progress(rows_read, cards_created)
+    validator: ValidationReport，在同一次读取中校验每批数据
+    sheets: 要导入的工作表名称列表，卡片记录sheet_name
+    read_batches: 读取文件的函数，参数和返回值与iter_file_batches相同
+    """
+    start_time = time.perf_counter()
+    writer = CardBatchWriter(collection, batch_size)
+    creation_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    rows_read = 0
+    sheet_rows = Counter()
+    for sheet_name, df in read_batches(file_path, writer.batch_size, sheets):
+        batch_start = sheet_rows[sheet_name]
+        sheet_rows[sheet_name] += len(df)
+        rows_read += len(df)
+        if sheets is None:
+            if rows_read <= skip_rows:
+                continue
+            if batch_start < skip_rows:
+                df = df.iloc[skip_rows - batch_start:]
+                batch_start = skip_rows
+
+        if validator is not None:
+            validator.update(df, sheet_name)
+        cards = build_cards_frame(df, user_id, username, file_id, creation_date, row_hashes=True)
+        _tag_cards(cards, sheet_name, batch_start)
+        for card in cards:
+            if extra_fields:
+                card.update(extra_fields)
+            writer.add(card)
+        writer.flush()
+        if progress:
+            progress(rows_read, writer.inserted)
+
+    elapsed = time.perf_counter() - start_time
+    stats = {
+        'rows_read': rows_read,
+        'rows_skipped': min(skip_rows, rows_read),
+        'cards_created': writer.inserted,
+        'write_errors': writer.write_errors,
+        'batches': writer.round_trips,
+        'batch_size': writer.batch_size,
+        'elapsed_seconds': round(elapsed, 3),
+        'rows_per_second': round(rows_read / elapsed, 1) if elapsed > 0 else 0.0
+    }
+    if sheets:
+        stats['sheets'] = {name: sheet_rows[name] for name in sheets}
+    if validator is not None:
+        stats['validation'] = validator.to_dict()
+        if validator.rows_with_issues:
+            logger.warning(f"文件数据校验: {validator.summary()}")
+    logger.info(f"卡片导入完成: {os.path.basename(file_path)}, 读取 {rows_read} 行, 写入 {writer.inserted} 张卡片, "
+                f"耗时 {stats['elapsed_seconds']} 秒")
+    return stats
+
+
+def preview_cards(df, user_id, username, file_id, validator=None, sheet_name=None):
+    """按与ingest_file相同的映射为read_head读取的前几行生成卡片（不写入数据库）"""
+    if validator is not None:
+        validator.update(df, sheet_name)
+    cards = build_cards_frame(df, user_id, username, file_id, row_hashes=True) if len(df) else []
+    _tag_cards(cards, sheet_name, 0)
+    return cards
+
+
+def _load_existing_cards(collection, scope):
+    """读取对比范围内已有卡片的row_hash和row_key，旧卡片没有哈希时读取全部字段计算"""
+    existing = list(collection.find({**scope, 'row_hash': {'$exists': True}},
+                                    {'row_hash': 1, 'row_key': 1, 'row_index': 1}))
+    legacy = list(collection.find({**scope, 'row_hash': {'$exists': False}},
+                                  {'data_source': 1, 'main_page': 1, 'detail_page': 1, 'row_index': 1}))
+    hash_existing_cards(legacy)
+    # 同一哈希或同一方案有多张卡片时按原来的行序对应
+    return sorted(existing + legacy, key=lambda card: card.get('row_index') or 0)
+
+
+def sync_file(collection, file_path, user_id, username, file_id, scope, delete_missing=False,
+              batch_size=DEFAULT_BATCH_SIZE, progress=None, validator=None, sheets=None,
+              read_batches=iter_file_batches):
+    """增量导入：与scope范围内已有的卡片对比，只写入新增和修改的行，返回导入统计信息
+
+    内容哈希相同的行视为未修改，不写数据库；哈希不同但来源、疾病和方案名称相同的行
+    更新原来的卡片；其余的行作为新卡片插入。表格中已不存在的卡片在delete_missing为True时删除。
+    """
+    start_time = time.perf_counter()
+    writer = CardBatchWriter(collection, batch_size)
+    creation_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    existing = _load_existing_cards(collection, scope)
+    remaining = {card['_id']: card['row_key'] for card in existing}
+    by_hash, by_key = {}, {}
+    for card in existing:
+        by_hash.setdefault(card['row_hash'], deque()).append(card['_id'])
+        by_key.setdefault(card['row_key'], deque()).append(card['_id'])
+    key_counts = Counter(remaining.values())
+
+    def take(ids):
+        """取出第一张尚未对应的卡片"""
+        while ids:
+            card_id = ids.popleft()
+            if card_id in remaining:
+                key_counts[remaining.pop(card_id)] -= 1
+                return card_id
+        return None
+
+    # 修改过的行先暂存，等所有未修改的行对应完之后再按row_key对应原卡片
+    rows_read = unchanged = 0
+    sheet_rows = Counter()
+    changed = []
+    for sheet_name, df in read_batches(file_path, writer.batch_size, sheets):
+        batch_start = sheet_rows[sheet_name]
+        sheet_rows[sheet_name] += len(df)
+        rows_read += len(df)
+        if validator is not None:
+            validator.update(df, sheet_name)
+        cards = build_cards_frame(df, user_id, username, file_id, creation_date, row_hashes=True)
+        _tag_cards(cards, sheet_name, batch_start)
+        for card in cards:
+            if take(by_hash.get(card['row_hash'])):
+                unchanged += 1
+            elif key_counts[card['row_key']] > 0:
+                changed.append(card)
+            else:
+                writer.add(card)
+        writer.flush()
+        if progress:
+            progress(rows_read, writer.inserted)
+
+    updated = 0
+    updates = []
+    for card in changed:
+        card_id = take(by_key.get(card['row_key']))
+        if card_id is None:
+            writer.add(card)
+            continue
+        fields = {
+            'file_id': card['file_id'],
+            'data_source': card['data_source'],
+            'main_page': card['main_page'],
+            'detail_page': card['detail_page'],
+            'presentation': card['presentation'],
+            'search_tokens': card['search_tokens'],
+            'numeric': card['numeric'],
+            'presentation_version': card['presentation_version'],
+            'row_index': card['row_index'],
+            'row_hash': card['row_hash'],
+            'row_key': card['row_key'],
+            'updated_at': datetime.utcnow()
+        }
+        if 'sheet_name' in card:
+            fields['sheet_name'] = card['sheet_name']
+        updates.append(UpdateOne({'_id': card_id}, {'$set': fields}))
+    writer.flush()
+    for start in range(0, len(updates), writer.batch_size):
+        result = collection.bulk_write(updates[start:start + writer.batch_size], ordered=False)
+        writer.round_trips += 1
+        updated += result.modified_count
+
+    deleted = 0
+    missing = list(remaining)
+    if delete_missing:
+        for start in range(0, len(missing), writer.batch_size):
+            result = collection.delete_many({'_id': {'$in': missing[start:start + writer.batch_size]}})
+            writer.round_trips += 1
+            deleted += result.deleted_count
+    if progress:
+        progress(rows_read, writer.inserted)
+
+    elapsed = time.perf_counter() - start_time
+    stats = {
+        'incremental': True,
+        'rows_read': rows_read,
+        'cards_compared': len(existing),
+        'cards_created': writer.inserted,
+        'cards_updated': updated,
+        'cards_deleted': deleted,
+        'cards_unchanged': unchanged,
+        'cards_missing': len(missing) - deleted,
+        'write_errors': writer.write_errors,
+        'batches': writer.round_trips,
+        'batch_size': writer.batch_size,
+        'elapsed_seconds': round(elapsed, 3),
+        'rows_per_second': round(rows_read / elapsed, 1) if elapsed > 0 else 0.0
+    }
+    if validator is not None:
+        stats['validation'] = validator.to_dict()
+        if validator.rows_with_issues:
+            logger.warning(f"文件数据校验: {validator.summary()}")
+    logger.info(f"增量导入完成: {os.path.basename(file_path)}, 读取 {rows_read} 行, 新增 {writer.inserted}, "
+                f"更新 {updated}, 删除 {deleted}, 未修改 {unchanged}, 耗时 {stats['elapsed_seconds']} 秒")
+    return stats
@@ -0,0 +1,124 @@
+import math
+
+from numeric_parser import count_value, percent_value, format_percent
+from card_query import RANGE_FIELDS, card_search_tokens
+
+# 卡片接口的显示格式：人数显示为整数，比率显示为百分比，缺失的风险概率使用默认值，
+# 并补充前端使用的别名字段。卡片写入时计算一次，与版本号一起保存在presentation字段中，
+# 列表和详情接口直接返回；显示格式修改后增加PRESENTATION_VERSION，
+# 再运行migrate_presentation.py重新生成已有卡片的presentation。
+# 关键词搜索使用的search_tokens和数值范围筛选使用的numeric同样在写入时生成，由同一个版本号和迁移脚本维护。
+
+# 1: 显示格式  2: 增加search_tokens  3: 增加numeric
+PRESENTATION_VERSION = 3
+
+# 风险概率缺失或无法解析时的默认显示值
+RISK_PROB_DEFAULTS = {1: '12.8%', 2: '5.2%', 3: '0.5%'}
+
+
+def display_percent(detail_page, key, default=None):
+    """比率的显示值：新卡片入库时已解析并格式化（保存在*_value字段中），只有旧卡片需要在这里解析"""
+    value = detail_page[key]
+    if detail_page.get(f'{key}_value') is not None or (isinstance(value, str) and '%' in value):
+        return value
+    number = percent_value(value)
+    if math.isnan(number):
+        return value if default is None else default
+    return format_percent(number)
+
+
+def present_detail_page(detail_page):
+    """按接口的显示格式整理详情页，返回合并到接口返回的卡片中的字段（detail_page和别名字段）"""
+    detail_page = dict(detail_page)
+
+    # 人数显示为整数
+    for key in ('total_patients', 'effective_patients', 'cured_patients'):
+        if key in detail_page:
+            try:
+                detail_page[key] = int(detail_page[key])
+            except (ValueError, TypeError):
+                pass
+
+    # 未复发人数，不存在或无法转换时为0，同时提供数字和字符串版本的别名
+    try:
+        no_relapse_value = int(detail_page.get('no_relapse_patients', 0))
+    except (ValueError, TypeError):
+        no_relapse_value = 0
+    detail_page['no_relapse_patients'] = no_relapse_value
+    detail_page['non_recurrence_count'] = no_relapse_value
+
+    # 有效率和未复发率使用百分比格式
+    for key in ('effective_rate', 'no_relapse_rate'):
+        if key in detail_page:
+            detail_page[key] = display_percent(detail_page, key)
+    detail_page.setdefault('no_relapse_rate', '0.0%')
+    detail_page['non_recurrence_rate'] = detail_page['no_relapse_rate']
+
+    # 风险表现（保留原始值，包括"未知"）和风险概率
+    risk_levels = {}
+    risk_probs = {}
+    for level in range(1, 4):
+        level_key = f'risk_level_{level}'
+        risk_levels[f'level_{level}'] = detail_page.setdefault(level_key, '未知')
+
+        prob_key = f'risk_prob_{level}'
+        if prob_key in detail_page:
+            detail_page[prob_key] = display_percent(detail_page, prob_key, RISK_PROB_DEFAULTS[level])
+        else:
+            detail_page[prob_key] = RISK_PROB_DEFAULTS[level]
+        risk_probs[f'prob_{level}'] = detail_page[prob_key]
+
+    presentation = {
+        'detail_page': detail_page,
+        'non_recurrence_count': no_relapse_value,
+        'non_recurrence_count_str': str(no_relapse_value),
+        'non_recurrence_rate': detail_page['no_relapse_rate'],
+        # 风险数据的顶层别名，方便前端访问
+        'risk_data': {
+            'levels': risk_levels,
+            'probabilities': risk_probs
+        }
+    }
+    for level in range(1, 4):
+        presentation[f'risk_level_{level}_symptom'] = risk_levels[f'level_{level}']
+        presentation[f'risk_level_{level}_rate'] = risk_probs[f'prob_{level}']
+    return presentation
+
+
+# 数值字段所在的页面和字段名: (字段名, 页面, 页面中的字段名, 类型)
+NUMERIC_SOURCES = [(name, *field.split('.', 1), kind) for name, field, kind in RANGE_FIELDS]
+
+
+def numeric_values(card):
+    """评分、人数和比率的数值（比率为百分数），无法解析的字段不包括在内"""
+    values = {}
+    for name, section, key, kind in NUMERIC_SOURCES:
+        page = card.get(section) or {}
+        if kind == 'percent':
+            # 新卡片入库时已解析（*_value字段），旧卡片在这里解析
+            parsed = page.get(f'{key}_value')
+            number = percent_value(page.get(key)) if parsed is None else float(parsed)
+        else:
+            number = count_value(page.get(key))
+        if not math.isnan(number):
+            values[name] = number
+    return values
+
+
+def presentation_fields(card):
+    """卡片文档中写入时生成的读取用字段（显示格式、搜索词元和数值），写入卡片或修改卡片内容时一起$set"""
+    return {
+        'presentation': present_detail_page(card['detail_page']),
+        'search_tokens': card_search_tokens(card),
+        'numeric': numeric_values(card),
+        'presentation_version': PRESENTATION_VERSION
+    }
+
+
+def card_presentation(card):
+    """返回卡片的显示格式：已保存且版本一致时直接使用，否则（迁移前的旧卡片）现场计算；没有详情页时返回None"""
+    if card.get('presentation_version') == PRESENTATION_VERSION and 'presentation' in card:
+        return card['presentation']
+    if 'detail_page' not in card:
+        return None
+    return present_detail_page(card['detail_page'])
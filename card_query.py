@@ -0,0 +1,334 @@
+import re
+import math
+import base64
+import binascii
+import unicodedata
+
+from bson import json_util
+from bson.errors import InvalidId
+
+# 卡片列表的查询条件与分页
+#
+# 游标分页（keyset）：按排序字段的值定位下一页的起点，每页都是一次从索引位置开始的范围查询，
+# 不像skip那样需要先跳过前面的所有卡片，第N页与第1页的开销相同。
+# 游标是上一页最后一张卡片排序字段值的编码，对客户端不透明，原样传回即可。
+#
+# 关键词搜索：中文没有空格分词，写入卡片时把方案名称、疾病和来源切分为单字和相邻两字
+# （n-gram），保存在search_tokens数组中，与user_id建立复合多键索引。查询时关键词同样切分，
+# 要求卡片包含全部词元（索引查找），再用正则表达式在候选卡片上确认包含完整的关键词，
+# 并按匹配的字段计算相关度排序。
+#
+# 字段选择：fields参数指定返回的字段，只有这些字段对应的数据从数据库读取。
+#
+# 筛选与分面统计：按疾病、三个评级和来源筛选卡片（同一字段多个值时为“或”）；分面统计用一次$facet聚合
+# 计算各字段每个值的卡片数。每个字段的统计不应用该字段自身的筛选条件，筛选栏中同一字段的其他选项
+# 仍然显示可以增加的卡片数。
+#
+# 数值范围筛选：评分、人数和比率在写入卡片时解析为数值，保存在numeric子文档中（比率保存为百分数），
+# min_<字段>和max_<字段>参数在数据库中按numeric.<字段>筛选，每个字段与user_id建立复合索引。
+
+# 卡片列表的默认排序（与user_id组成复合索引）
+DEFAULT_SORT = [('_id', 1)]
+
+# 关键词搜索按相关度从高到低排序，相同时按_id
+SEARCH_SORT = [('search_score', -1), ('_id', 1)]
+
+# 参与关键词搜索的字段及其相关度权重
+SEARCH_FIELDS = [('main_page.plan_name', 4), ('main_page.disease', 2), ('data_source', 1)]
+
+# 方案名称与关键词完全相同时额外增加的相关度
+EXACT_MATCH_BONUS = 4
+
+# fields参数可选的卡片字段；detail_page包括详情页的显示格式和前端使用的别名字段
+CARD_FIELDS = ('card_id', 'user_id', 'username', 'creation_date', 'template_type', 'data_source',
+               'main_page', 'uploader', 'detail_page')
+
+# 首页（main_page）中可以单独选择的字段，fields中可以直接写字段名（如plan_name）或main_page.plan_name
+MAIN_PAGE_KEYS = ('plan_name', 'disease', 'benefit_grade', 'benefit_score', 'risk_grade', 'risk_score',
+                  'treatment_duration', 'cost_range', 'convenience_grade', 'convenience_score',
+                  'cost_min', 'cost_max')
+
+# 各字段需要从数据库读取的字段；uploader缺失时使用username
+FIELD_PROJECTIONS = {
+    'card_id': [],
+    'user_id': ['user_id'],
+    'username': ['username'],
+    'creation_date': ['creation_date'],
+    'template_type': ['template_type'],
+    'data_source': ['data_source'],
+    'main_page': ['main_page'],
+    'uploader': ['uploader', 'username'],
+    'detail_page': ['presentation', 'presentation_version']
+}
+
+# 可以筛选和分面统计的字段: (参数名, 卡片字段)
+FACET_FIELDS = [
+    ('disease', 'main_page.disease'),
+    ('benefit_grade', 'main_page.benefit_grade'),
+    ('risk_grade', 'main_page.risk_grade'),
+    ('convenience_grade', 'main_page.convenience_grade'),
+    ('data_source', 'data_source')
+]
+
+# 可以按范围筛选的数值字段: (参数中的字段名, 卡片中的原始字段, 类型)，percent为比率，number为评分和人数
+RANGE_FIELDS = [
+    ('benefit_score', 'main_page.benefit_score', 'number'),
+    ('risk_score', 'main_page.risk_score', 'number'),
+    ('convenience_score', 'main_page.convenience_score', 'number'),
+    ('total_patients', 'detail_page.total_patients', 'number'),
+    ('effective_patients', 'detail_page.effective_patients', 'number'),
+    ('cured_patients', 'detail_page.cured_patients', 'number'),
+    ('no_relapse_patients', 'detail_page.no_relapse_patients', 'number'),
+    ('effective_rate', 'detail_page.effective_rate', 'percent'),
+    ('cure_rate', 'detail_page.cure_rate', 'percent'),
+    ('no_relapse_rate', 'detail_page.no_relapse_rate', 'percent'),
+    ('risk_prob_1', 'detail_page.risk_prob_1', 'percent'),
+    ('risk_prob_2', 'detail_page.risk_prob_2', 'percent'),
+    ('risk_prob_3', 'detail_page.risk_prob_3', 'percent')
+]
+
+
+class QueryError(Exception):
+    """查询参数无效，status_code为返回给客户端的HTTP状态码"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def _normalize_search_text(value):
+    """全角转半角、统一小写"""
+    return unicodedata.normalize('NFKC', str(value)).lower()
+
+
+def _text_tokens(text):
+    """文本切分为单字和相邻两字，空白处断开"""
+    tokens = set()
+    for segment in _normalize_search_text(text).split():
+        tokens.update(segment)
+        tokens.update(segment[i:i + 2] for i in range(len(segment) - 1))
+    return tokens
+
+
+def card_search_tokens(card):
+    """卡片的搜索词元，写入卡片时保存在search_tokens中"""
+    tokens = set()
+    for field, _ in SEARCH_FIELDS:
+        value = field_value(card, field)
+        if value is not None:
+            tokens |= _text_tokens(value)
+    return sorted(tokens)
+
+
+def keyword_tokens(keyword):
+    """查询使用的词元：单个字直接查询，两个字以上查询所有相邻两字"""
+    tokens = []
+    for segment in _normalize_search_text(keyword).split():
+        tokens.extend([segment] if len(segment) == 1 else [segment[i:i + 2] for i in range(len(segment) - 1)])
+    return list(dict.fromkeys(tokens))
+
+
+def keyword_conditions(keyword):
+    """关键词搜索条件：方案名称、疾病或来源包含关键词
+
+    search_tokens包含全部词元的条件使用索引缩小范围；尚未生成词元的旧卡片
+    （见migrate_presentation.py）只用正则表达式判断。关键词按普通文本匹配，不作为正则表达式。
+    """
+    pattern = re.escape(keyword)
+    contains = {'$or': [{field: {'$regex': pattern, '$options': 'i'}} for field, _ in SEARCH_FIELDS]}
+    tokens = keyword_tokens(keyword)
+    if not tokens:
+        return contains
+    indexed = {'$or': [{'search_tokens': {'$all': tokens}}, {'search_tokens': {'$exists': False}}]}
+    return {'$and': [indexed, contains]}
+
+
+def relevance_score(keyword):
+    """相关度表达式：各字段包含关键词时加上字段权重，方案名称完全相同时再加EXACT_MATCH_BONUS"""
+    pattern = re.escape(keyword)
+
+    def matches(field, regex):
+        text = {'$ifNull': [{'$toString': f'${field}'}, '']}
+        return {'$regexMatch': {'input': text, 'regex': regex, 'options': 'i'}}
+
+    terms = [{'$cond': [matches(field, pattern), weight, 0]} for field, weight in SEARCH_FIELDS]
+    terms.append({'$cond': [matches('main_page.plan_name', f'^{pattern}$'), EXACT_MATCH_BONUS, 0]})
+    return {'$add': terms}
+
+
+def search_pipeline(conditions, keyword, projection, after=None, skip=0, limit=10):
+    """关键词搜索的聚合管道：按相关度排序后分页，返回的卡片带有search_score（用于生成游标）"""
+    pipeline = [
+        {'$match': conditions},
+        {'$addFields': {'search_score': relevance_score(keyword)}}
+    ]
+    if after:
+        pipeline.append({'$match': after})
+    pipeline.append({'$sort': dict(SEARCH_SORT)})
+    if skip:
+        pipeline.append({'$skip': skip})
+    pipeline.append({'$limit': limit})
+    pipeline.append({'$project': {**projection, 'search_score': 1}})
+    return pipeline
+
+
+def field_value(card, field):
+    """按点分隔的路径读取卡片中的字段，不存在时返回None"""
+    value = card
+    for part in field.split('.'):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def encode_cursor(card, sort=DEFAULT_SORT):
+    """把卡片的排序字段值编码为游标"""
+    values = [field_value(card, field) for field, _ in sort]
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort=DEFAULT_SORT):
+    """解析游标为排序字段值列表，无效时抛出QueryError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json_util.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError, binascii.Error, InvalidId, UnicodeError):
+        raise QueryError('无效的分页游标')
+    if not isinstance(values, list) or len(values) != len(sort):
+        raise QueryError('无效的分页游标')
+    return values
+
+
+def after_cursor(values, sort=DEFAULT_SORT):
+    """排在游标之后的卡片的查询条件
+
+    多个排序字段时依次比较：前面的字段相等且当前字段在游标之后。
+    """
+    clauses = []
+    for index, (field, direction) in enumerate(sort):
+        clause = {prefix: value for (prefix, _), value in zip(sort[:index], values)}
+        clause[field] = {'$gt' if direction > 0 else '$lt': values[index]}
+        clauses.append(clause)
+    return clauses[0] if len(clauses) == 1 else {'$or': clauses}
+
+
+def merge_conditions(*conditions):
+    """合并多个查询条件；字段重复（如都有$or）时使用$and组合"""
+    merged = {}
+    for condition in conditions:
+        if set(condition) & set(merged):
+            return {'$and': list(conditions)}
+        merged.update(condition)
+    return merged
+
+
+def parse_fields(value=None, show_details=True):
+    """解析fields参数（逗号分隔的字段名），返回字段集合
+
+    没有fields参数时返回全部字段，show_details为false时不包括detail_page。
+    首页字段保存为main_page.<字段名>，选择了整个main_page时不再单独保存。字段名无效时抛出QueryError。
+    """
+    names = [name.strip() for name in (value or '').split(',') if name.strip()]
+    if not names:
+        return set(CARD_FIELDS) if show_details else set(CARD_FIELDS) - {'detail_page'}
+    fields = {'card_id'}
+    invalid = []
+    for name in names:
+        key = name[len('main_page.'):] if name.startswith('main_page.') else name
+        if name in CARD_FIELDS:
+            fields.add(name)
+        elif key in MAIN_PAGE_KEYS:
+            fields.add(f'main_page.{key}')
+        else:
+            invalid.append(name)
+    if invalid:
+        raise QueryError(f"无效的字段: {', '.join(invalid)}")
+    if 'main_page' in fields:
+        fields = {field for field in fields if not field.startswith('main_page.')}
+    return fields
+
+
+def fields_projection(fields):
+    """fields对应的MongoDB投影，只读取返回这些字段需要的数据（_id总是返回）"""
+    projection = {}
+    for field in fields:
+        for path in FIELD_PROJECTIONS.get(field, [field]):
+            projection[path] = 1
+    return projection or {'_id': 1}
+
+
+def facet_filters(args):
+    """请求参数中的筛选条件，返回{参数名: 查询条件}；同一参数可以重复传入多个值（如disease=a&disease=b）"""
+    filters = {}
+    for name, field in FACET_FIELDS:
+        values = list(dict.fromkeys(value.strip() for value in args.getlist(name) if value.strip()))
+        if values:
+            filters[name] = {field: values[0] if len(values) == 1 else {'$in': values}}
+    return filters
+
+
+def filter_conditions(filters, exclude=None):
+    """合并筛选条件，exclude为不应用的参数名"""
+    conditions = {}
+    for name, condition in filters.items():
+        if name != exclude:
+            conditions.update(condition)
+    return conditions
+
+
+def facet_pipeline(conditions, filters, limit=50):
+    """分面统计的聚合管道
+
+    conditions为用户和关键词条件（使用索引），filters为facet_filters的结果。
+    每个字段返回卡片数最多的limit个值，total为应用全部筛选条件后的卡片数。
+    """
+    facets = {}
+    for name, field in FACET_FIELDS:
+        stages = []
+        others = filter_conditions(filters, exclude=name)
+        if others:
+            stages.append({'$match': others})
+        stages += [
+            {'$group': {'_id': f'${field}', 'count': {'$sum': 1}}},
+            {'$sort': {'count': -1, '_id': 1}},
+            {'$limit': limit}
+        ]
+        facets[name] = stages
+    matched = filter_conditions(filters)
+    facets['total'] = ([{'$match': matched}] if matched else []) + [{'$count': 'count'}]
+    return [
+        {'$match': conditions},
+        # 只保留统计需要的字段，可以由(user_id, 分面字段)复合索引覆盖
+        {'$project': {'_id': 0, **{field: 1 for _, field in FACET_FIELDS}}},
+        {'$facet': facets}
+    ]
+
+
+def facet_results(result):
+    """整理$facet的结果为{'facets': {参数名: [{'value', 'count'}]}, 'total': 卡片数}"""
+    result = result or {}
+    facets = {name: [{'value': item['_id'], 'count': item['count']} for item in result.get(name, [])]
+              for name, _ in FACET_FIELDS}
+    total = result.get('total') or [{'count': 0}]
+    return {'facets': facets, 'total': total[0]['count']}
+
+
+def range_conditions(args):
+    """请求参数中的数值范围条件（min_<字段>、max_<字段>，包含边界），参数不是数字时抛出QueryError"""
+    conditions = {}
+    for name, _, _ in RANGE_FIELDS:
+        bounds = {}
+        for prefix, operator in (('min_', '$gte'), ('max_', '$lte')):
+            value = args.get(prefix + name, '').strip()
+            if not value:
+                continue
+            try:
+                number = float(value)
+            except ValueError:
+                number = math.nan
+            if not math.isfinite(number):
+                raise QueryError(f"{prefix}{name}必须是数字")
+            bounds[operator] = number
+        if bounds:
+            conditions[f'numeric.{name}'] = bounds
+    return conditions
@@ -0,0 +1,43 @@
+import os
+import tempfile
+
+from card_ingest import ENCODING_SAMPLE_SIZE, sniff_encoding
+
+
+def write_sample(path, text, encoding, split_char):
+    """写入CSV，使采样的最后一个字节恰好是split_char编码后的第一个字节"""
+    head = text.encode(encoding)
+    padding = ENCODING_SAMPLE_SIZE - 1 - len(head)
+    with open(path, 'wb') as f:
+        f.write(head + b'a' * padding + split_char.encode(encoding) + '\n'.encode(encoding) + text.encode(encoding))
+
+
+def check_sniff_encoding():
+    text = '方案名称,疾病\n标准降压治疗,高血压\n'
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for encoding, expected in [('gbk', 'gb18030'), ('utf-8', 'utf-8-sig')]:
+            path = os.path.join(tmp_dir, f'{encoding}.csv')
+            write_sample(path, text, encoding, '高')
+            with open(path, 'rb') as f:
+                sample = f.read(ENCODING_SAMPLE_SIZE)
+            # 确认采样确实截断在字符中间
+            assert sample.endswith('高'.encode(encoding)[:1]), encoding
+            result = sniff_encoding(path)
+            print(f"{encoding}: 采样截断在多字节字符中间 -> {result}")
+            assert result == expected, f"{encoding}: 识别为{result}，应为{expected}"
+
+            # 小于采样大小的文件，末尾不完整的字符仍然是错误
+            with open(path, 'wb') as f:
+                f.write(text.encode(encoding) + '高'.encode(encoding)[:1])
+            try:
+                result = sniff_encoding(path)
+            except ValueError:
+                result = None
+            print(f"{encoding}: 完整文件末尾字符不完整 -> {result}")
+            assert result is None, f"{encoding}: 不完整的文件不应识别为{result}"
+
+    print("CSV编码识别检查通过")
+
+
+if __name__ == '__main__':
+    check_sniff_encoding()
@@ -10,5 +10,8 @@ source venv/bin/activate
 # 安装依赖包
 pip install -r requirements.txt
 
+# 创建缺少的数据库索引
+python3 db_indexes.py
+
 # 启动应用
 python3 app.py
\ No newline at end of file
@@ -0,0 +1,206 @@
+import os
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from progress_events import ProgressTracker
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 任务状态
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+
+# 单个任务最多记录的错误条数
+MAX_JOB_ERRORS = 20
+
+
+class JobManager:
+    """本地后台任务管理器
+
+    任务持久化在jobs集合中，由进程内线程池执行，不依赖外部消息队列。
+    执行中的任务由单独的线程定期写入心跳（与处理函数是否报告进度无关，解析或写入一批数据较慢时
+    也不会被误判为失效），进程崩溃后心跳超时的任务会在下次启动时重新排队，
+    处理函数可根据任务中记录的进度从中断处继续。
+    进度同时写入进程内的tracker，供SSE接口实时推送。
+    """
+
+    def __init__(self, db, max_workers=2, heartbeat_timeout=300):
+        self.collection = db.jobs
+        self.heartbeat_timeout = heartbeat_timeout
+        # 心跳间隔取超时时间的三分之一，数据库短暂不可用时不会立即超时
+        self.heartbeat_interval = heartbeat_timeout / 3
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.handlers = {}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job-worker')
+        self.lock = threading.Lock()
+        self.tracker = ProgressTracker()
+
+    def register(self, job_type, handler):
+        """注册任务处理函数，handler(job, progress)返回结果字典"""
+        self.handlers[job_type] = handler
+
+    def submit(self, job_type, user_id, payload):
+        """创建任务并交给线程池执行，返回任务ID"""
+        if job_type not in self.handlers:
+            raise ValueError(f"未注册的任务类型: {job_type}")
+
+        now = datetime.utcnow()
+        job = {
+            'type': job_type,
+            'user_id': ObjectId(user_id),
+            'payload': payload,
+            'state': JOB_QUEUED,
+            'progress': {},
+            'rows_processed': 0,
+            'errors': [],
+            'attempts': 0,
+            'created_at': now,
+            'updated_at': now
+        }
+        job_id = self.collection.insert_one(job).inserted_id
+        logger.info(f"创建后台任务: {job_id}, 类型: {job_type}")
+        self.executor.submit(self._run, job_id)
+        return str(job_id)
+
+    def get(self, job_id):
+        return self.collection.find_one({'_id': ObjectId(job_id)})
+
+    def retry(self, job_id):
+        """将失败的任务重新排队，已记录的进度保留以便续跑"""
+        job = self.collection.find_one_and_update(
+            {'_id': ObjectId(job_id), 'state': JOB_FAILED},
+            {'$set': {'state': JOB_QUEUED, 'updated_at': datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        )
+        if job:
+            logger.info(f"重试后台任务: {job_id}")
+            self.executor.submit(self._run, job['_id'])
+        return job
+
+    def recover(self):
+        """进程启动时恢复任务：心跳超时的执行中任务重新排队，排队中的任务重新提交"""
+        stale_before = datetime.utcnow() - timedelta(seconds=self.heartbeat_timeout)
+        result = self.collection.update_many(
+            {'state': JOB_RUNNING, 'heartbeat_at': {'$lt': stale_before}},
+            {'$set': {'state': JOB_QUEUED, 'updated_at': datetime.utcnow()}}
+        )
+        if result.modified_count:
+            logger.warning(f"{result.modified_count} 个后台任务的执行进程已失效，重新排队")
+
+        resubmitted = 0
+        for job in self.collection.find({'state': JOB_QUEUED}, {'_id': 1}):
+            self.executor.submit(self._run, job['_id'])
+            resubmitted += 1
+        if resubmitted:
+            logger.info(f"重新提交 {resubmitted} 个排队中的后台任务")
+        return resubmitted
+
+    def _claim(self, job_id):
+        """原子地认领排队中的任务，避免多个进程重复执行"""
+        now = datetime.utcnow()
+        return self.collection.find_one_and_update(
+            {'_id': job_id, 'state': JOB_QUEUED},
+            {
+                '$set': {
+                    'state': JOB_RUNNING,
+                    'worker': self.worker_id,
+                    'started_at': now,
+                    'heartbeat_at': now,
+                    'updated_at': now
+                },
+                '$unset': {'finished_at': '', 'duration_seconds': ''},
+                '$inc': {'attempts': 1}
+            },
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _run(self, job_id):
+        job = self._claim(job_id)
+        if not job:
+            return
+
+        def progress(rows_processed, **fields):
+            now = datetime.utcnow()
+            update = {'rows_processed': rows_processed, 'heartbeat_at': now, 'updated_at': now}
+            for key, value in fields.items():
+                update[f'progress.{key}'] = value
+            self.collection.update_one({'_id': job_id}, {'$set': update})
+            self.tracker.update(job_id, rows_processed, **fields)
+
+        logger.info(f"开始执行后台任务: {job_id}, 第 {job['attempts']} 次尝试")
+        self.tracker.start(job_id, job.get('rows_processed', 0))
+        stop_heartbeat = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, stop_heartbeat),
+                                     name=f'job-heartbeat-{job_id}', daemon=True)
+        heartbeat.start()
+        try:
+            result = self.handlers[job['type']](job, progress)
+            state, update = JOB_SUCCEEDED, {'result': result}
+            final = {'result': result}
+        except Exception as e:
+            logger.error(f"后台任务执行失败: {job_id}, 错误: {str(e)}", exc_info=True)
+            state, update = JOB_FAILED, {}
+            self.collection.update_one(
+                {'_id': job_id},
+                {'$push': {'errors': {'$each': [{'message': str(e), 'at': datetime.utcnow()}], '$slice': -MAX_JOB_ERRORS}}}
+            )
+            final = {'error': str(e)}
+        finally:
+            stop_heartbeat.set()
+            heartbeat.join()
+
+        finished_at = datetime.utcnow()
+        update.update({
+            'state': state,
+            'finished_at': finished_at,
+            'duration_seconds': round((finished_at - job['started_at']).total_seconds(), 3),
+            'updated_at': finished_at
+        })
+        self.collection.update_one({'_id': job_id}, {'$set': update})
+        self.tracker.finish(job_id, state, **final)
+        logger.info(f"后台任务结束: {job_id}, 状态: {state}")
+
+    def _heartbeat(self, job_id, stop):
+        """任务执行期间定期刷新心跳，直到stop被设置"""
+        while not stop.wait(self.heartbeat_interval):
+            try:
+                self.collection.update_one(
+                    {'_id': job_id, 'state': JOB_RUNNING, 'worker': self.worker_id},
+                    {'$set': {'heartbeat_at': datetime.utcnow()}}
+                )
+            except Exception as e:
+                logger.warning(f"刷新任务心跳失败: {job_id}, 错误: {str(e)}")
+
+
+def serialize_job(job):
+    """将任务文档转换为API响应格式"""
+    duration = job.get('duration_seconds')
+    if duration is None and job.get('started_at'):
+        duration = round((datetime.utcnow() - job['started_at']).total_seconds(), 3)
+
+    def fmt(value):
+        return value.strftime('%Y-%m-%d %H:%M:%S') if value else None
+
+    return {
+        'job_id': str(job['_id']),
+        'type': job['type'],
+        'state': job['state'],
+        'rows_processed': job.get('rows_processed', 0),
+        'progress': job.get('progress', {}),
+        'result': job.get('result'),
+        'errors': [error['message'] for error in job.get('errors', [])],
+        'attempts': job.get('attempts', 0),
+        'created_at': fmt(job.get('created_at')),
+        'started_at': fmt(job.get('started_at')),
+        'finished_at': fmt(job.get('finished_at')),
+        'duration_seconds': duration
+    }
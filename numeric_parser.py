@@ -0,0 +1,136 @@
+import re
+import math
+
+import numpy as np
+import pandas as pd
+
+# 模板数值解析：人数（93人）、百分比（85.11%、0.85）、金额（200元/次）和范围（100-1000）
+#
+# 单个值的解析函数与按列解析函数使用同一组预编译的正则表达式。按列解析时先对整列去重，
+# 只解析不同的取值，再按编码映射回整列，重复值很多的模板列只需解析几百次。
+
+# 全角字符和各种连接符统一为半角
+_NORMALIZE_TABLE = str.maketrans({
+    **{chr(0xFF10 + i): str(i) for i in range(10)},
+    '．': '.', '，': ',', '％': '%', '／': '/',
+    '－': '-', '—': '-', '–': '-', '~': '-', '～': '-', '至': '-', '到': '-'
+})
+
+_NUMBER = r'\d+(?:,\d{3})*(?:\.\d+)?|\.\d+'
+
+# 人数：约93人、共120例、1,200名
+COUNT_PATTERN = re.compile(rf'(?:约|共|总计|合计)?\s*({_NUMBER})\s*(?:人次|人|例|名|位|个)?')
+
+# 比率：85.11%、0.85、85
+PERCENT_PATTERN = re.compile(rf'(?:约)?\s*({_NUMBER})\s*(%)?')
+
+# 金额单位：元、元/次、万元/疗程
+_MONEY_UNIT = r'\s*(万)?\s*(?:元|块)?\s*(?:/\s*(?:次|天|日|周|月|年|疗程|人))?'
+
+# 金额或金额范围：100-1000、1-2万元、200元/次
+AMOUNT_RANGE_PATTERN = re.compile(rf'(?:约)?\s*({_NUMBER}){_MONEY_UNIT}\s*(?:-\s*({_NUMBER}){_MONEY_UNIT})?')
+
+# 只有下限或上限：5000以上、1000元以内
+AMOUNT_BOUND_PATTERN = re.compile(rf'({_NUMBER}){_MONEY_UNIT}\s*(以上|及以上|起|以下|以内|及以下)')
+
+_LOWER_BOUND_WORDS = ('以上', '及以上', '起')
+
+
+def _is_number(value):
+    return isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool)
+
+
+def _to_float(text):
+    return float(text.replace(',', ''))
+
+
+def normalize_text(value):
+    return str(value).translate(_NORMALIZE_TABLE).strip()
+
+
+def count_value(value):
+    """解析人数，无法解析时返回NaN"""
+    if _is_number(value):
+        return float(value)
+    if not isinstance(value, str):
+        return math.nan
+    match = COUNT_PATTERN.fullmatch(normalize_text(value))
+    return _to_float(match.group(1)) if match else math.nan
+
+
+def percent_value(value):
+    """解析比率为百分数（0-100）；没有%且小于1的值视为小数形式，乘以100"""
+    if _is_number(value):
+        number = float(value)
+        return number * 100 if number < 1 else number
+    if not isinstance(value, str):
+        return math.nan
+    match = PERCENT_PATTERN.fullmatch(normalize_text(value))
+    if not match:
+        return math.nan
+    number = _to_float(match.group(1))
+    return number if match.group(2) or number >= 1 else number * 100
+
+
+def amount_range(value):
+    """解析金额或金额范围，返回(下限, 上限)，无法解析的部分为NaN"""
+    if _is_number(value):
+        return float(value), float(value)
+    if not isinstance(value, str):
+        return math.nan, math.nan
+    text = normalize_text(value)
+
+    match = AMOUNT_RANGE_PATTERN.fullmatch(text)
+    if match:
+        low, low_wan, high, high_wan = match.groups()
+        # 1-2万：单位只写在后面时两端都按万计算
+        low_scale = 10000 if (low_wan or (high and high_wan)) else 1
+        low = _to_float(low) * low_scale
+        if high is None:
+            return low, low
+        return low, _to_float(high) * (10000 if high_wan else 1)
+
+    match = AMOUNT_BOUND_PATTERN.fullmatch(text)
+    if match:
+        number = _to_float(match.group(1)) * (10000 if match.group(2) else 1)
+        if match.group(3) in _LOWER_BOUND_WORDS:
+            return number, math.nan
+        return math.nan, number
+    return math.nan, math.nan
+
+
+def _parse_column(values, parse_one, width=1):
+    """整列去重后解析不同的取值，再按编码映射回整列"""
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    parsed = np.array([parse_one(value) for value in uniques], dtype=float).reshape(len(uniques), width)
+    result = np.full((len(values), width), np.nan)
+    present = codes >= 0
+    result[present] = parsed[codes[present]]
+    return result
+
+
+def parse_counts(values):
+    """按列解析人数，返回浮点数Series，无法解析为NaN"""
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        return values.astype(float)
+    return pd.Series(_parse_column(values, count_value)[:, 0], index=values.index)
+
+
+def parse_percents(values):
+    """按列解析比率为百分数（0-100），返回浮点数Series，无法解析为NaN"""
+    return pd.Series(_parse_column(values, percent_value)[:, 0], index=values.index)
+
+
+def parse_amount_ranges(values):
+    """按列解析金额范围，返回包含min、max两列的DataFrame"""
+    return pd.DataFrame(_parse_column(values, amount_range, width=2), index=values.index, columns=['min', 'max'])
+
+
+def format_percent(value):
+    """百分数的显示格式，与卡片接口一致保留一位小数"""
+    return f"{value:.1f}%"
+
+
+def to_stored(values):
+    """浮点数列转换为写入MongoDB的列表，NaN写为None"""
+    return [None if math.isnan(value) else value for value in values.tolist()]
@@ -0,0 +1,259 @@
+import os
+import sys
+import time
+import types
+import logging
+import zipfile
+import resource
+import threading
+import multiprocessing
+import multiprocessing.connection
+from collections import deque
+
+from card_ingest import file_extension, iter_row_batches
+
+# 在子进程中解析用户上传的表格：pandas/openpyxl解析异常文件（巨大的共享字符串表、
+# 高压缩率的压缩包、数百万行只有样式的空行）时可能长时间占满CPU并占用数GB内存，
+# 放在Web进程中会影响同一进程的所有用户。每次解析启动一个有内存和时间限制的子进程，
+# 解析出的数据按批通过管道发回父进程；同时运行的解析进程数有上限。
+#
+# Web进程中有后台任务线程和pymongo的监控线程，直接fork可能复制其他线程持有的锁，
+# 子进程由forkserver启动（forkserver进程预先导入card_ingest，启动子进程只需fork这个单线程进程）。
+# forkserver不使用父进程的sys.path，启动时把本模块所在目录加入PYTHONPATH，否则不在代码目录下
+# 启动服务时预先导入会静默失败，每个子进程都要重新导入pandas。
+# 子进程不重新执行主模块：app.py以脚本方式运行，重新执行会再次连接数据库并启动后台任务线程，
+# 因此子进程中执行的函数必须定义在可导入的模块中。
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 启动子进程时临时隐藏主模块的__file__和__spec__并修改PYTHONPATH，多个线程同时启动子进程时需要互斥
+_start_lock = threading.Lock()
+
+# 本模块所在目录，forkserver预先导入card_ingest时需要
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 每个解析进程在继承自父进程的地址空间之外最多再使用的内存（字节）
+DEFAULT_MEMORY_LIMIT = 1024 * 1024 * 1024
+
+# 等待解析进程发回下一批数据的最长时间（秒）；父进程处理数据（如写入数据库）的时间不计算在内
+DEFAULT_TIME_LIMIT = 900
+
+# 默认等待空闲解析名额的最长时间（秒），超时返回503；后台任务可以指定更长的等待时间
+DEFAULT_SLOT_TIMEOUT = 10
+
+# xlsx压缩包检查：解压后的总大小、成员数量、共享字符串表大小和单个成员的压缩率
+MAX_UNCOMPRESSED_SIZE = 1024 * 1024 * 1024
+MAX_ZIP_ENTRIES = 10000
+MAX_SHARED_STRINGS_SIZE = 256 * 1024 * 1024
+MAX_COMPRESSION_RATIO = 100
+
+# 小于此大小的成员不检查压缩率（很小的XML压缩率高是正常的）
+RATIO_CHECK_MIN_SIZE = 1024 * 1024
+
+
+class ParserError(Exception):
+    """上传文件被拒绝或解析失败，status_code为返回给客户端的HTTP状态码"""
+
+    def __init__(self, message, status_code=422):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def check_spreadsheet(source, extension, max_uncompressed_size=MAX_UNCOMPRESSED_SIZE):
+    """只读取xlsx的压缩包目录，在解析之前拒绝异常文件；source为文件路径或文件对象
+
+    CSV和xls不是压缩包，不做检查。
+    """
+    if extension != 'xlsx':
+        return
+    try:
+        with zipfile.ZipFile(source) as archive:
+            members = archive.infolist()
+    except (zipfile.BadZipFile, OSError):
+        raise ParserError('文件不是有效的xlsx文件', 400)
+
+    if len(members) > MAX_ZIP_ENTRIES:
+        raise ParserError(f'xlsx文件包含的部件过多（{len(members)}个）', 400)
+    total_size = sum(member.file_size for member in members)
+    if total_size > max_uncompressed_size:
+        raise ParserError(f'xlsx文件解压后过大（{total_size // (1024 * 1024)}MB）', 400)
+    for member in members:
+        if member.filename.endswith('sharedStrings.xml') and member.file_size > MAX_SHARED_STRINGS_SIZE:
+            raise ParserError(f'xlsx文件的共享字符串表过大（{member.file_size // (1024 * 1024)}MB）', 400)
+        if member.file_size >= RATIO_CHECK_MIN_SIZE and \
+                member.file_size > max(member.compress_size, 1) * MAX_COMPRESSION_RATIO:
+            raise ParserError(f'xlsx文件压缩率异常: {member.filename}', 400)
+
+
+def _limit_memory(limit):
+    """限制子进程的地址空间：fork时继承的部分加上limit"""
+    try:
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[0]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        current = 0
+    resource.setrlimit(resource.RLIMIT_AS, (current + limit, current + limit))
+
+
+def _run_child(conn, func, args, memory_limit):
+    """子进程：执行func(*args)，生成器的每一项或函数的返回值通过管道发回父进程
+
+    管道写满时send阻塞，父进程处理较慢时子进程随之等待；不使用multiprocessing.Queue，
+    超出内存限制时不会因为无法启动队列的发送线程而卡住。结束时发回子进程的内存峰值（ru_maxrss）。
+    """
+    if memory_limit:
+        _limit_memory(memory_limit)
+    try:
+        result = func(*args)
+        for item in result if isinstance(result, types.GeneratorType) else [result]:
+            conn.send(('item', item))
+        conn.send(('done', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+    except MemoryError:
+        conn.send(('error', '解析文件超出内存限制'))
+    except Exception as e:
+        conn.send(('error', f'解析文件失败: {e}'))
+    finally:
+        conn.close()
+        # 直接退出，不执行继承的退出处理（如线程池的atexit在子进程中会失败）
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(0)
+
+
+class ParserPool:
+    """在有资源限制的子进程中解析上传文件
+
+    max_workers为同时运行的解析进程数上限（所有请求共享）；每次解析都启动新的子进程，
+    超时或超出内存的进程可以直接结束，不影响其他解析。time_limit限制的是父进程等待下一批数据的时间，
+    导入大文件时总耗时可以超过time_limit，只要子进程持续发回数据。
+    名额已满时最多等待slot_timeout秒（call和iter_batches可单独指定），Web请求不会长时间阻塞。
+    """
+
+    def __init__(self, max_workers=None, memory_limit=DEFAULT_MEMORY_LIMIT, time_limit=DEFAULT_TIME_LIMIT,
+                 max_uncompressed_size=MAX_UNCOMPRESSED_SIZE, slot_timeout=DEFAULT_SLOT_TIMEOUT):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.memory_limit = memory_limit
+        self.time_limit = time_limit
+        self.slot_timeout = slot_timeout
+        # 正常结束的解析进程中最大的内存峰值（ru_maxrss，Linux下单位为KB），供基准测试统计
+        self.peak_child_maxrss = 0
+        self.max_uncompressed_size = max_uncompressed_size
+        self.slots = threading.BoundedSemaphore(self.max_workers)
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            self.context = multiprocessing.get_context('forkserver')
+            self.context.set_forkserver_preload(['card_ingest'])
+        else:
+            self.context = multiprocessing.get_context('spawn')
+
+    def check(self, source, extension):
+        check_spreadsheet(source, extension, self.max_uncompressed_size)
+
+    def call(self, file_path, func, *args, slot_timeout=None):
+        """在子进程中执行func(file_path, *args)并返回结果"""
+        self.check(file_path, file_extension(file_path))
+        result = None
+        for _, result in self._stream([(None, func, (file_path,) + args)], slot_timeout):
+            pass
+        return result
+
+    def iter_batches(self, file_path, batch_size, sheets=None, slot_timeout=None):
+        """按批读取上传文件，返回(工作表名, DataFrame)，与card_ingest.iter_file_batches相同
+
+        多个工作表各由一个子进程并行解析，按到达顺序返回。
+        """
+        self.check(file_path, file_extension(file_path))
+        if not sheets:
+            tasks = [(None, iter_row_batches, (file_path, batch_size))]
+        else:
+            tasks = [(name, iter_row_batches, (file_path, batch_size, name)) for name in sheets]
+        yield from self._stream(tasks, slot_timeout)
+
+    def _start(self, func, args):
+        """启动子进程，返回[进程, 管道读端, 截止时间]"""
+        reader, writer = self.context.Pipe(duplex=False)
+        process = self.context.Process(target=_run_child, args=(writer, func, args, self.memory_limit), daemon=True)
+        with _start_lock:
+            main_module = sys.modules['__main__']
+            main_path = main_module.__dict__.pop('__file__', None)
+            main_spec, main_module.__spec__ = getattr(main_module, '__spec__', None), None
+            python_path = os.environ.get('PYTHONPATH')
+            # forkserver在第一次启动子进程（或退出后重新启动）时创建，继承此时的环境变量
+            os.environ['PYTHONPATH'] = os.pathsep.join(filter(None, [MODULE_DIR, python_path]))
+            try:
+                # 主模块没有__file__和__spec__时，multiprocessing不会在子进程中重新执行主模块
+                process.start()
+            finally:
+                main_module.__spec__ = main_spec
+                if main_path is not None:
+                    main_module.__file__ = main_path
+                if python_path is None:
+                    del os.environ['PYTHONPATH']
+                else:
+                    os.environ['PYTHONPATH'] = python_path
+        # 父进程关闭写端，子进程退出后读端可以收到EOF
+        writer.close()
+        return [process, reader, time.monotonic() + self.time_limit]
+
+    def _stream(self, tasks, slot_timeout=None):
+        """启动子进程执行tasks中的(键, 函数, 参数)，返回(键, 数据)"""
+        if slot_timeout is None:
+            slot_timeout = self.slot_timeout
+        pending = deque(tasks)
+        running = {}
+        try:
+            while pending or running:
+                # 没有运行中的进程时等待空闲名额，否则只使用当前空闲的名额
+                while pending:
+                    if running:
+                        if not self.slots.acquire(blocking=False):
+                            break
+                    elif not self.slots.acquire(timeout=slot_timeout):
+                        raise ParserError('解析任务繁忙，请稍后重试', 503)
+                    key, func, args = pending.popleft()
+                    running[key] = self._start(func, args)
+
+                readers = {reader: key for key, (_, reader, _) in running.items()}
+                for reader in multiprocessing.connection.wait(list(readers), timeout=0.5):
+                    key = readers[reader]
+                    try:
+                        kind, payload = reader.recv()
+                    except EOFError:
+                        raise ParserError('解析进程异常退出，文件可能超出内存限制')
+                    if kind == 'item':
+                        # 收到数据后重新计时；调用方处理这批数据期间子进程在管道上等待，这段时间不计入
+                        suspended_at = time.monotonic()
+                        yield key, payload
+                        resumed_at = time.monotonic()
+                        for worker in running.values():
+                            worker[2] += resumed_at - suspended_at
+                        if key in running:
+                            running[key][2] = resumed_at + self.time_limit
+                    elif kind == 'done':
+                        self.peak_child_maxrss = max(self.peak_child_maxrss, payload)
+                        self._finish(running.pop(key))
+                    else:
+                        raise ParserError(payload)
+                self._check(running)
+        finally:
+            # 提前结束（出错或调用方不再读取）时结束仍在运行的子进程
+            for worker in running.values():
+                worker[0].kill()
+                self._finish(worker)
+
+    def _finish(self, worker):
+        process, reader, _ = worker
+        process.join()
+        reader.close()
+        self.slots.release()
+
+    def _check(self, running):
+        now = time.monotonic()
+        for process, _, deadline in running.values():
+            if process.exitcode not in (None, 0):
+                logger.warning(f"解析进程异常退出: pid {process.pid}, 退出码 {process.exitcode}")
+                raise ParserError('解析进程异常退出，文件可能超出内存限制')
+            if now > deadline:
+                logger.warning(f"解析进程超时: pid {process.pid}, 超过 {self.time_limit} 秒没有发回数据")
+                raise ParserError(f'解析文件超时（超过{self.time_limit}秒没有进展）')
@@ -0,0 +1,88 @@
+import json
+import time
+import threading
+
+# 任务结束后进度在内存中保留的秒数，供稍晚连接的客户端读取最终状态
+FINISHED_RETENTION = 300
+
+
+class ProgressTracker:
+    """进程内的任务进度，由导入循环每批写入后更新，SSE连接等待变化后推送
+
+    更新只是加锁修改一个字典并唤醒等待的连接，不访问数据库。
+    """
+
+    def __init__(self, retention=FINISHED_RETENTION):
+        self.retention = retention
+        self.condition = threading.Condition()
+        self.entries = {}
+
+    def start(self, job_id, rows_done=0):
+        """任务开始执行；rows_done为续跑时已完成的行数，不计入速度"""
+        now = time.monotonic()
+        with self.condition:
+            # 顺便清理已结束较久的任务
+            for key in [key for key, entry in self.entries.items()
+                        if entry['finished_at'] and now - entry['finished_at'] > self.retention]:
+                del self.entries[key]
+            self.entries[str(job_id)] = {
+                'version': 0,
+                'started_at': now,
+                'finished_at': None,
+                'rows_at_start': rows_done,
+                'snapshot': {'job_id': str(job_id), 'state': 'running', 'rows_processed': rows_done}
+            }
+            self.condition.notify_all()
+
+    def update(self, job_id, rows_processed, **fields):
+        with self.condition:
+            entry = self.entries.get(str(job_id))
+            if not entry:
+                return
+            snapshot = entry['snapshot']
+            snapshot['rows_processed'] = rows_processed
+            snapshot.update(fields)
+
+            # 根据本次运行的速度和预计总行数估算剩余时间
+            elapsed = time.monotonic() - entry['started_at']
+            rate = (rows_processed - entry['rows_at_start']) / elapsed if elapsed > 0 else 0.0
+            snapshot['rows_per_second'] = round(rate, 1)
+            total_rows = snapshot.get('total_rows')
+            if total_rows:
+                snapshot['percent'] = round(min(rows_processed / total_rows, 1.0) * 100, 1)
+                snapshot['eta_seconds'] = round(max(total_rows - rows_processed, 0) / rate, 1) if rate > 0 else None
+            entry['version'] += 1
+            self.condition.notify_all()
+
+    def finish(self, job_id, state, **fields):
+        with self.condition:
+            entry = self.entries.get(str(job_id))
+            if not entry:
+                return
+            entry['snapshot'].update(fields, state=state, eta_seconds=0)
+            entry['finished_at'] = time.monotonic()
+            entry['version'] += 1
+            self.condition.notify_all()
+
+    def wait(self, job_id, version, timeout):
+        """等待进度版本号超过version，返回(版本号, 进度快照)；任务不在本进程中时返回None"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                entry = self.entries.get(str(job_id))
+                if not entry:
+                    return None
+                remaining = deadline - time.monotonic()
+                if entry['version'] > version or remaining <= 0:
+                    return entry['version'], dict(entry['snapshot'])
+                self.condition.wait(remaining)
+
+
+def format_event(event, data, event_id=None):
+    """按Server-Sent Events格式输出一条消息"""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, ensure_ascii=False, default=str)}')
+    return '\n'.join(lines) + '\n\n'
@@ -0,0 +1,244 @@
+import os
+import hashlib
+import logging
+import time
+import threading
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 从请求流读取数据的块大小
+STREAM_BUFFER_SIZE = 64 * 1024
+
+# 上传会话状态
+SESSION_OPEN = 'open'
+SESSION_COMPLETED = 'completed'
+
+# 未完成的会话超过这个时间（秒）没有上传分片即过期，删除会话和临时文件
+DEFAULT_SESSION_TTL = 24 * 3600
+
+# 两次清理过期会话的最短间隔（秒）
+SWEEP_INTERVAL = 3600
+
+
+class UploadError(Exception):
+    """分片上传错误，status_code为返回给客户端的HTTP状态码"""
+
+    def __init__(self, message, status_code=400, **details):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.details = details
+
+
+class UploadSessionStore:
+    """可续传的分片上传
+
+    每个会话对应一个临时文件，分片按序号和偏移量顺序追加，直接从请求流写入磁盘。
+    会话进度保存在upload_sessions集合中，连接中断后客户端查询已接收的字节数继续上传。
+    整个文件的SHA-256随分片增量计算；进程重启后从临时文件重新计算。
+    超过session_ttl秒没有上传分片的未完成会话视为放弃，由sweep删除会话和临时文件。
+    """
+
+    def __init__(self, db, tmp_folder, max_upload_size, session_ttl=DEFAULT_SESSION_TTL):
+        self.collection = db.upload_sessions
+        self.tmp_folder = tmp_folder
+        self.max_upload_size = max_upload_size
+        self.session_ttl = session_ttl
+        self.hashers = {}  # {会话ID: (已计算的字节数, sha256对象)}
+        self.locks = {}
+        self.locks_guard = threading.Lock()
+        self.last_sweep = 0.0
+        os.makedirs(tmp_folder, exist_ok=True)
+
+    def _lock(self, session_id):
+        with self.locks_guard:
+            return self.locks.setdefault(session_id, threading.Lock())
+
+    def _hasher(self, session):
+        """取得会话的增量SHA-256，不在内存中时从临时文件重新计算"""
+        session_id = str(session['_id'])
+        cached = self.hashers.get(session_id)
+        if cached and cached[0] == session['received_bytes']:
+            return cached[1]
+
+        hasher = hashlib.sha256()
+        remaining = session['received_bytes']
+        with open(session['temp_path'], 'rb') as f:
+            while remaining > 0:
+                data = f.read(min(STREAM_BUFFER_SIZE, remaining))
+                if not data:
+                    break
+                hasher.update(data)
+                remaining -= len(data)
+        self.hashers[session_id] = (session['received_bytes'], hasher)
+        return hasher
+
+    def _forget(self, session_id):
+        self.hashers.pop(session_id, None)
+        with self.locks_guard:
+            self.locks.pop(session_id, None)
+
+    def sweep(self):
+        """删除过期的未完成会话及其临时文件，以及没有对应会话的过期临时文件，返回删除的会话数"""
+        self.last_sweep = time.monotonic()
+        cutoff = datetime.utcnow() - timedelta(seconds=self.session_ttl)
+        expired = 0
+        for session in self.collection.find({'state': SESSION_OPEN, 'updated_at': {'$lt': cutoff}},
+                                            {'temp_path': 1}):
+            session_id = str(session['_id'])
+            with self._lock(session_id):
+                # 加锁后再次按更新时间删除，期间上传了分片的会话不会被删除
+                result = self.collection.delete_one({'_id': session['_id'], 'state': SESSION_OPEN,
+                                                     'updated_at': {'$lt': cutoff}})
+                if result.deleted_count:
+                    self._remove_file(session['temp_path'])
+                    expired += 1
+            if result.deleted_count:
+                self._forget(session_id)
+
+        # 进程中断后遗留的临时文件（包括整文件上传的临时文件）
+        open_paths = {session['temp_path'] for session in self.collection.find({'state': SESSION_OPEN},
+                                                                                {'temp_path': 1})}
+        cutoff_time = time.time() - self.session_ttl
+        for entry in os.scandir(self.tmp_folder):
+            if (entry.is_file() and entry.name.endswith('.part') and entry.path not in open_paths
+                    and entry.stat().st_mtime < cutoff_time):
+                self._remove_file(entry.path)
+        if expired:
+            logger.info(f"删除 {expired} 个过期的上传会话")
+        return expired
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def create(self, user_id, file_name, total_size, expected_sha256=None):
+        # 创建会话时顺便清理过期的会话，最多每SWEEP_INTERVAL秒一次
+        if time.monotonic() - self.last_sweep >= SWEEP_INTERVAL:
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warning(f"清理过期上传会话失败: {str(e)}")
+
+        if total_size <= 0:
+            raise UploadError('文件大小无效')
+        if total_size > self.max_upload_size:
+            raise UploadError(f'文件大小超过上限 {self.max_upload_size} 字节', 413)
+
+        session_id = ObjectId()
+        temp_path = os.path.join(self.tmp_folder, f'{session_id}.part')
+        open(temp_path, 'wb').close()
+
+        now = datetime.utcnow()
+        self.collection.insert_one({
+            '_id': session_id,
+            'user_id': user_id,
+            'file_name': file_name,
+            'total_size': total_size,
+            'expected_sha256': expected_sha256.lower() if expected_sha256 else None,
+            'temp_path': temp_path,
+            'received_bytes': 0,
+            'next_chunk': 0,
+            'state': SESSION_OPEN,
+            'created_at': now,
+            'updated_at': now
+        })
+        logger.info(f"创建上传会话: {session_id}, 文件: {file_name}, 大小: {total_size}")
+        return self.collection.find_one({'_id': session_id})
+
+    def get(self, session_id, user_id):
+        try:
+            session = self.collection.find_one({'_id': ObjectId(session_id)})
+        except (InvalidId, TypeError):
+            raise UploadError('上传会话不存在', 404)
+        if not session or session['user_id'] != user_id:
+            raise UploadError('上传会话不存在', 404)
+        return session
+
+    def write_chunk(self, session_id, user_id, index, offset, stream, chunk_sha256=None):
+        """将一个分片从请求流追加到临时文件，返回更新后的会话"""
+        with self._lock(session_id):
+            session = self.get(session_id, user_id)
+            if session['state'] != SESSION_OPEN:
+                raise UploadError('上传会话已结束', 409)
+            # 分片必须按顺序续传，返回当前进度以便客户端从正确位置重试
+            if index != session['next_chunk'] or offset != session['received_bytes']:
+                raise UploadError('分片序号或偏移量不匹配', 409,
+                                  next_chunk=session['next_chunk'], received_bytes=session['received_bytes'])
+
+            file_hasher = self._hasher(session).copy()
+            chunk_hasher = hashlib.sha256()
+            written = 0
+            with open(session['temp_path'], 'r+b') as f:
+                f.seek(offset)
+                f.truncate()
+                while True:
+                    data = stream.read(STREAM_BUFFER_SIZE)
+                    if not data:
+                        break
+                    written += len(data)
+                    if offset + written > session['total_size']:
+                        f.truncate(offset)
+                        raise UploadError('分片数据超出文件大小', 413)
+                    f.write(data)
+                    chunk_hasher.update(data)
+                    file_hasher.update(data)
+
+                if not written:
+                    raise UploadError('分片内容为空')
+                if chunk_sha256 and chunk_hasher.hexdigest() != chunk_sha256.lower():
+                    # 校验失败时丢弃该分片，客户端从同一偏移量重传
+                    f.truncate(offset)
+                    raise UploadError('分片校验失败', 422,
+                                      next_chunk=session['next_chunk'], received_bytes=offset)
+
+            received_bytes = offset + written
+            self.collection.update_one(
+                {'_id': session['_id']},
+                {'$set': {'received_bytes': received_bytes, 'next_chunk': index + 1, 'updated_at': datetime.utcnow()}}
+            )
+            self.hashers[session_id] = (received_bytes, file_hasher)
+            session.update(received_bytes=received_bytes, next_chunk=index + 1)
+            return session
+
+    def complete(self, session_id, user_id):
+        """校验文件完整性并结束会话，返回(临时文件路径, SHA-256)"""
+        with self._lock(session_id):
+            session = self.get(session_id, user_id)
+            if session['state'] != SESSION_OPEN:
+                raise UploadError('上传会话已结束', 409)
+            if session['received_bytes'] != session['total_size']:
+                raise UploadError('文件尚未上传完整', 409,
+                                  next_chunk=session['next_chunk'], received_bytes=session['received_bytes'])
+
+            sha256 = self._hasher(session).hexdigest()
+            if session['expected_sha256'] and sha256 != session['expected_sha256']:
+                raise UploadError('文件校验失败，请重新上传', 422, sha256=sha256)
+
+            self.collection.update_one(
+                {'_id': session['_id']},
+                {'$set': {'state': SESSION_COMPLETED, 'sha256': sha256, 'updated_at': datetime.utcnow()}}
+            )
+            self._forget(session_id)
+            logger.info(f"上传会话完成: {session_id}, SHA-256: {sha256}")
+            return session['temp_path'], sha256
+
+
+def serialize_session(session):
+    """将上传会话转换为API响应格式"""
+    return {
+        'upload_id': str(session['_id']),
+        'file_name': session['file_name'],
+        'total_size': session['total_size'],
+        'received_bytes': session['received_bytes'],
+        'next_chunk': session['next_chunk'],
+        'state': session['state']
+    }
@@ -0,0 +1,182 @@
+import os
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+from numeric_parser import parse_counts
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 必需的核心列，不再区分模板类型
+REQUIRED_COLUMNS = ['疾病', '方案名称', '方案简介', '治疗时间', '费用范围']
+
+# 需要为正整数的列
+POSITIVE_INTEGER_COLUMNS = ['总人数']
+
+# 每类问题最多保留的示例数
+MAX_EXAMPLES = 5
+
+# 问题类型说明
+ISSUE_MESSAGES = {
+    'invalid_text': '不是有效的文本，将使用默认值',
+    'empty': '为空，将使用默认值',
+    'not_integer': '不是有效的整数，将使用默认值',
+    'not_positive': '必须大于0，将使用默认值'
+}
+
+# 模板结构缓存: {模板路径: (文件签名, 模板结构)}
+_schema_cache = {}
+_schema_lock = threading.Lock()
+
+
+def _file_signature(path):
+    """模板文件的修改时间和大小，文件变化时缓存失效"""
+    try:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+    except FileNotFoundError:
+        return None
+
+
+def load_template_schema(template_path):
+    """读取模板表头作为校验结构，模板文件未变化时直接使用缓存"""
+    signature = _file_signature(template_path)
+    with _schema_lock:
+        cached = _schema_cache.get(template_path)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+        if signature is None:
+            # 模板不存在时只校验必需列，不报告模板外的列
+            logger.warning(f"模板文件不存在: {template_path}，使用内置的必需列校验")
+            columns = None
+        else:
+            workbook = load_workbook(template_path, read_only=True)
+            try:
+                header = next(workbook.worksheets[0].iter_rows(max_row=1, values_only=True), ())
+            finally:
+                workbook.close()
+            columns = [str(col) for col in header if col is not None]
+            logger.info(f"加载模板结构: {template_path}, 共 {len(columns)} 列")
+
+        schema = {
+            'template_path': template_path,
+            'columns': columns,
+            'required_columns': REQUIRED_COLUMNS,
+            'positive_integer_columns': POSITIVE_INTEGER_COLUMNS
+        }
+        _schema_cache[template_path] = (signature, schema)
+        return schema
+
+
+class ValidationReport:
+    """上传文件数据校验报告
+
+    按批接收DataFrame，用整列掩码检查必需列和数值列，
+    只累计每类问题的数量和前N个示例，不逐行写日志。
+    """
+
+    def __init__(self, schema, max_examples=MAX_EXAMPLES):
+        self.schema = schema
+        self.max_examples = max_examples
+        self.missing_columns = []
+        self.unknown_columns = []
+        self.rows_checked = 0
+        self.rows_with_issues = 0
+        self.row_examples = []
+        self.issues = {}
+
+    def check_columns(self, columns):
+        """检查表头，返回缺少的必需列"""
+        columns = [str(col) for col in columns]
+        self.missing_columns = [col for col in self.schema['required_columns'] if col not in columns]
+        if self.schema['columns'] is not None:
+            self.unknown_columns = [col for col in columns if col not in self.schema['columns']]
+        return self.missing_columns
+
+    def _record(self, df, column, code, mask, row_flags, sheet_name=None):
+        count = int(mask.sum())
+        if not count:
+            return
+        issue = self.issues.setdefault((column, code), {
+            'column': column,
+            'code': code,
+            'message': f"{column}{ISSUE_MESSAGES[code]}",
+            'count': 0,
+            'examples': []
+        })
+        issue['count'] += count
+        room = self.max_examples - len(issue['examples'])
+        if room > 0:
+            for index, value in df.loc[mask, column].head(room).items():
+                issue['examples'].append(self._example(sheet_name, int(index) + 2,
+                                                       value=None if pd.isna(value) else str(value)))
+        row_flags[column] = row_flags[column] | mask if column in row_flags else mask
+
+    @staticmethod
+    def _example(sheet_name, row, **fields):
+        """问题示例，多工作表导入时记录所在的工作表"""
+        example = {'sheet': sheet_name} if sheet_name is not None else {}
+        example['row'] = row
+        example.update(fields)
+        return example
+
+    def update(self, df, sheet_name=None):
+        """校验一批数据，DataFrame索引为数据行序号（Excel行号为索引+2），sheet_name为数据所在的工作表"""
+        row_flags = {}
+
+        # 必需的文本字段：空值或非文本
+        for column in self.schema['required_columns']:
+            if column not in df.columns:
+                continue
+            values = df[column]
+            if values.dtype == object:
+                is_text = values.map(type) == str
+            else:
+                is_text = pd.Series(False, index=df.index)
+            self._record(df, column, 'invalid_text', ~is_text, row_flags, sheet_name)
+
+        # 正整数字段：空值、无法转换为整数（“93人”等带单位的写法可以识别）、小于等于0
+        for column in self.schema['positive_integer_columns']:
+            if column not in df.columns:
+                continue
+            values = df[column]
+            empty = values.isna()
+            numbers = parse_counts(values)
+            not_integer = ~empty & numbers.isna()
+            not_positive = numbers.notna() & (np.trunc(numbers) <= 0)
+            self._record(df, column, 'empty', empty, row_flags, sheet_name)
+            self._record(df, column, 'not_integer', not_integer, row_flags, sheet_name)
+            self._record(df, column, 'not_positive', not_positive, row_flags, sheet_name)
+
+        self.rows_checked += len(df)
+        if not row_flags:
+            return
+        flags = pd.DataFrame(row_flags, index=df.index)
+        bad_rows = flags.any(axis=1)
+        self.rows_with_issues += int(bad_rows.sum())
+        room = self.max_examples - len(self.row_examples)
+        if room > 0:
+            for index, row in flags[bad_rows].head(room).iterrows():
+                self.row_examples.append(self._example(sheet_name, int(index) + 2,
+                                                       columns=row.index[row.values].tolist()))
+
+    def to_dict(self):
+        return {
+            'valid': not self.missing_columns,
+            'missing_columns': self.missing_columns,
+            'unknown_columns': self.unknown_columns,
+            'rows_checked': self.rows_checked,
+            'rows_with_issues': self.rows_with_issues,
+            'row_examples': self.row_examples,
+            'issues': list(self.issues.values())
+        }
+
+    def summary(self):
+        """一行日志摘要"""
+        counts = ', '.join(f"{issue['message']}: {issue['count']}" for issue in self.issues.values())
+        return f"共检查 {self.rows_checked} 行，{self.rows_with_issues} 行存在问题" + (f"（{counts}）" if counts else '')